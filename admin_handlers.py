@@ -1,14 +1,44 @@
 # admin_handlers.py
-from config import ADMIN_IDS
-from database import get_interested_users, get_paid_users, get_message_history, add_message
+from config import (
+    ADMIN_IDS,
+    HISTORY_PAGE_SIZE,
+    ROSTER_PAGE_SIZE,
+    INBOX_PAGE_SIZE,
+    SEARCH_PAGE_SIZE,
+    PROFILE_MAX_SECONDS
+)
+from database import (
+    get_roster_page,
+    get_message_history_page,
+    add_reply,
+    get_inbox_page,
+    assign_support_thread,
+    search_users,
+    search_messages,
+    get_daily_stats,
+    get_stats_totals
+)
+from user_cache import user_cache
+from exporter import export_dataset, EXPORT_FORMATS
+from router import get_router
+from profiler import profile
 from datetime import datetime
+import os
+import tempfile
+import threading
+import telebot
+
+# Ограничение Telegram на длину сообщения (с запасом)
+MAX_MESSAGE_LENGTH = 4000
 
 def register_admin_handlers(bot):
+    router = get_router(bot)
+
     def is_admin(user_id):
         """Проверка, является ли пользователь администратором"""
         return user_id in ADMIN_IDS
 
-    @bot.message_handler(commands=['admin'])
+    @router.command('admin')
     def admin_panel(message):
         """Панель администратора"""
         if not is_admin(message.from_user.id):
@@ -19,52 +49,437 @@ def register_admin_handlers(bot):
                         "Доступные команды:\n" \
                         "/users - список заинтересованных пользователей\n" \
                         "/paid - список оплативших пользователей\n" \
+                        "/inbox - открытые обращения пользователей\n" \
                         "/history [user_id] - история сообщений с пользователем\n" \
-                        "/reply [user_id] [сообщение] - ответить пользователю"
+                        "/search [запрос] - поиск по сообщениям и именам пользователей\n" \
+                        "/reply [user_id] [сообщение] - ответить пользователю\n" \
+                        "/stats [дни] - воронка и конверсия по дням\n" \
+                        "/cache - статистика кэша пользователей\n" \
+                        "/profile [секунды] - профиль нагрузки бота\n" \
+                        "/export [users|paid|messages] [csv|jsonl] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] - выгрузка в файл"
 
         bot.reply_to(message, admin_message)
 
-    @bot.message_handler(commands=['users'])
-    def list_interested_users(message):
-        """Список заинтересованных пользователей"""
-        if not is_admin(message.from_user.id):
-            return
+    # Постраничные списки: callback-префикс -> (таблица, заголовок, текст для пустого списка)
+    rosters = {
+        'users': ('interested_users', "👥 Заинтересованные пользователи:", "Нет заинтересованных пользователей."),
+        'paid': ('paid_users', "💰 Оплатившие пользователи:", "Нет оплативших пользователей."),
+    }
 
-        users = get_interested_users()
+    def render_roster_page(kind, after_id=None, before_id=None):
+        """Текст и клавиатура одной страницы списка пользователей"""
+        roster, title, _ = rosters[kind]
+        users, has_prev, has_next = get_roster_page(roster, after_id, before_id, ROSTER_PAGE_SIZE)
         if not users:
-            bot.reply_to(message, "Нет заинтересованных пользователей.")
-            return
+            return None, None
 
-        response = "👥 Заинтересованные пользователи:\n\n"
-        for i, user in enumerate(users, 1):
-            user_id, username, first_name, last_name, interested_at = user
+        # Строки, не поместившиеся в сообщение, уходят на соседнюю страницу: при листании
+        # назад отбрасываются самые ранние, иначе — самые поздние, и курсор берётся
+        # по последней показанной строке
+        backward = before_id is not None
+        entries = []
+        length = len(title) + 1
+        for user_id, username, first_name, last_name, date in (reversed(users) if backward else users):
             username_display = f"@{username}" if username else "без username"
             name_display = f"{first_name} {last_name}" if last_name else first_name
-            response += f"{i}. {username_display} ({name_display}) - {interested_at[:10]}\n"
+            line = f"{user_id} — {username_display} ({name_display}) - {date[:10]}"
+            if entries and length + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                if backward:
+                    has_prev = True
+                else:
+                    has_next = True
+                break
+            entries.append((user_id, line))
+            length += len(line) + 1
+        if backward:
+            entries.reverse()
+
+        response = "\n".join([title, ""] + [line for _, line in entries])[:MAX_MESSAGE_LENGTH]
 
-        bot.reply_to(message, response)
+        buttons = []
+        if has_prev:
+            buttons.append(telebot.types.InlineKeyboardButton(
+                "⬅️ Назад", callback_data=f"{kind}:prev:{entries[0][0]}"))
+        if has_next:
+            buttons.append(telebot.types.InlineKeyboardButton(
+                "Вперёд ➡️", callback_data=f"{kind}:next:{entries[-1][0]}"))
+        if not buttons:
+            return response, None
 
-    @bot.message_handler(commands=['paid'])
+        keyboard = telebot.types.InlineKeyboardMarkup()
+        keyboard.add(*buttons)
+        return response, keyboard
+
+    def send_roster(message, kind):
+        if not is_admin(message.from_user.id):
+            return
+
+        response, keyboard = render_roster_page(kind)
+        if response is None:
+            bot.reply_to(message, rosters[kind][2])
+            return
+
+        bot.reply_to(message, response, reply_markup=keyboard)
+
+    @router.command('users')
+    def list_interested_users(message):
+        """Список заинтересованных пользователей"""
+        send_roster(message, 'users')
+
+    @router.command('paid')
     def list_paid_users(message):
         """Список оплативших пользователей"""
+        send_roster(message, 'paid')
+
+    @bot.callback_query_handler(func=lambda call: call.data.split(':')[0] in rosters)
+    @router.callback
+    def page_roster(call):
+        """Листание списков пользователей"""
+        bot.answer_callback_query(call.id)
+        if not is_admin(call.from_user.id):
+            return
+
+        kind, direction, cursor_id = call.data.split(':')
+        if direction == 'next':
+            response, keyboard = render_roster_page(kind, after_id=int(cursor_id))
+        else:
+            response, keyboard = render_roster_page(kind, before_id=int(cursor_id))
+        if response is None:
+            return
+
+        bot.edit_message_text(
+            response,
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+
+    @router.command('export')
+    def export_data(message):
+        """Выгрузка списков и истории сообщений в сжатый CSV/JSONL"""
         if not is_admin(message.from_user.id):
             return
 
-        users = get_paid_users()
-        if not users:
-            bot.reply_to(message, "Нет оплативших пользователей.")
+        usage = "Используйте: /export [users|paid|messages] [csv|jsonl] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]"
+        parts = message.text.split()[1:]
+        if not parts:
+            bot.reply_to(message, usage)
             return
 
-        response = "💰 Оплатившие пользователи:\n\n"
-        for i, user in enumerate(users, 1):
-            user_id, username, first_name, last_name, paid_at = user
-            username_display = f"@{username}" if username else "без username"
-            name_display = f"{first_name} {last_name}" if last_name else first_name
-            response += f"{i}. {username_display} ({name_display}) - {paid_at[:10]}\n"
+        dataset = parts.pop(0)
+        fmt = parts.pop(0) if parts and parts[0] in EXPORT_FORMATS else 'csv'
+        since = parts[0] if len(parts) > 0 else None
+        until = parts[1] if len(parts) > 1 else None
+
+        try:
+            path, filename = export_dataset(dataset, fmt, since, until)
+        except ValueError as e:
+            bot.reply_to(message, f"{e}\n\n{usage}")
+            return
+
+        try:
+            with open(path, 'rb') as f:
+                bot.send_document(
+                    message.chat.id,
+                    f,
+                    reply_to_message_id=message.message_id,
+                    visible_file_name=filename
+                )
+        except Exception as e:
+            bot.reply_to(message, f"Не удалось отправить выгрузку: {str(e)}")
+        finally:
+            os.remove(path)
+
+    def run_profile(chat_id, reply_to, seconds):
+        """Замер профиля в отдельном потоке и отправка отчёта"""
+        result = profile(seconds)
+        if result is None:
+            bot.send_message(chat_id, "Замер профиля уже идёт, попробуйте позже.")
+            return
+
+        bot.send_message(chat_id, result.report()[:MAX_MESSAGE_LENGTH], reply_to_message_id=reply_to)
+
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        os.close(fd)
+        try:
+            result.write_stacks(path)
+            with open(path, 'rb') as f:
+                bot.send_document(chat_id, f, visible_file_name=f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt",
+                                  caption="Свёрнутые стеки (flamegraph.pl / speedscope)")
+        finally:
+            os.remove(path)
+
+    @router.command('profile')
+    def start_profile(message):
+        """Профилирование всех потоков бота на заданное время"""
+        if not is_admin(message.from_user.id):
+            return
+
+        parts = message.text.split()
+        try:
+            seconds = int(parts[1]) if len(parts) > 1 else 10
+        except ValueError:
+            bot.reply_to(message, "Используйте: /profile [секунды]")
+            return
+        if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+            bot.reply_to(message, f"Длительность замера — от 1 до {PROFILE_MAX_SECONDS} секунд.")
+            return
+
+        bot.reply_to(message, f"⏱ Профилирую {seconds} с...")
+        threading.Thread(
+            target=run_profile,
+            args=(message.chat.id, message.message_id, seconds),
+            name='profiler',
+            daemon=True
+        ).start()
 
-        bot.reply_to(message, response)
+    def format_funnel(joined, interested, paid, delivered, blocked):
+        """Строки воронки с конверсией между этапами"""
+        def share(part, whole):
+            return f"{part / whole:.1%}" if whole else "—"
+
+        return [
+            f"👤 Пришли: {joined}",
+            f"⭐ Заинтересовались: {interested} ({share(interested, joined)})",
+            f"💰 Оплатили: {paid} ({share(paid, interested)} от заинтересованных, {share(paid, joined)} от пришедших)",
+            f"📨 Доставлено рассылок: {delivered}",
+            f"🚫 Заблокировали бота: {blocked}",
+        ]
+
+    @router.command('stats')
+    def show_stats(message):
+        """Воронка по дням из таблицы daily_stats (без подсчёта по большим таблицам)"""
+        if not is_admin(message.from_user.id):
+            return
+
+        parts = message.text.split()
+        try:
+            days = int(parts[1]) if len(parts) > 1 else 7
+        except ValueError:
+            bot.reply_to(message, "Используйте: /stats [дни]")
+            return
+        days = max(1, min(days, 365))
+
+        rows = get_daily_stats(days)
+        period = [sum(row[i] for row in rows) for i in range(1, 6)]
+
+        lines = [f"📊 Статистика за {days} дн.", ""]
+        lines += format_funnel(*period)
+        lines += ["", "По дням (пришли / заинтересовались / оплатили / доставлено / заблокировали):"]
+        for day, joined, interested, paid, delivered, blocked in rows:
+            lines.append(f"{day[8:10]}.{day[5:7]}: {joined} / {interested} / {paid} / {delivered} / {blocked}")
+        if not rows:
+            lines.append("Нет данных.")
+        lines += ["", "За всё время:"]
+        lines += format_funnel(*get_stats_totals())
+
+        bot.reply_to(message, "\n".join(lines)[:MAX_MESSAGE_LENGTH])
+
+    @router.command('cache')
+    def show_cache_stats(message):
+        """Статистика кэша статусов пользователей и защиты от флуда"""
+        if not is_admin(message.from_user.id):
+            return
 
-    @bot.message_handler(commands=['history'])
+        stats = user_cache.stats()
+        flood = router.flood_control.stats()
+        bot.reply_to(
+            message,
+            f"🗄 Кэш пользователей\n\n"
+            f"Записей: {stats['size']} из {stats['max_size']}\n"
+            f"Попаданий: {stats['hits']}\n"
+            f"Промахов: {stats['misses']}\n"
+            f"Вытеснений: {stats['evictions']}\n"
+            f"Доля попаданий: {stats['hit_rate']:.1%}\n\n"
+            f"🚦 Защита от флуда\n\n"
+            f"Пользователей: {flood['tracked_users']} из {flood['max_users']}\n"
+            f"Пропущено: {flood['allowed']}\n"
+            f"Отброшено: {flood['dropped']} ({flood['drop_rate']:.1%})"
+        )
+
+    def render_inbox_page(after_id=None):
+        """Текст и клавиатура одной страницы открытых обращений"""
+        threads, next_cursor = get_inbox_page(after_id, INBOX_PAGE_SIZE)
+        if not threads:
+            return None, None
+
+        lines = ["📥 Открытые обращения (сначала самые давние):", ""]
+        for user_id, username, first_name, unread, _, last_message, assigned_to in threads:
+            name_display = f"@{username}" if username else (first_name or "без имени")
+            assigned = f", взял {assigned_to}" if assigned_to else ""
+            lines.append(f"👤 {user_id} ({name_display}) — сообщений: {unread}{assigned}")
+            lines.append(f"«{last_message[:200]}»")
+            lines.append(f"/history {user_id}")
+            lines.append("")
+        response = "\n".join(lines)[:MAX_MESSAGE_LENGTH]
+
+        buttons = []
+        if after_id is not None:
+            buttons.append(telebot.types.InlineKeyboardButton("⏮ В начало", callback_data="inbox:"))
+        if next_cursor is not None:
+            buttons.append(telebot.types.InlineKeyboardButton(
+                "Вперёд ➡️", callback_data=f"inbox:{next_cursor}"))
+        if not buttons:
+            return response, None
+
+        keyboard = telebot.types.InlineKeyboardMarkup()
+        keyboard.add(*buttons)
+        return response, keyboard
+
+    @router.command('inbox')
+    def show_inbox(message):
+        """Открытые обращения пользователей"""
+        if not is_admin(message.from_user.id):
+            return
+
+        response, keyboard = render_inbox_page()
+        if response is None:
+            bot.reply_to(message, "📭 Открытых обращений нет.")
+            return
+
+        bot.reply_to(message, response, reply_markup=keyboard)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith('inbox:'))
+    @router.callback
+    def page_inbox(call):
+        """Листание открытых обращений"""
+        bot.answer_callback_query(call.id)
+        if not is_admin(call.from_user.id):
+            return
+
+        after_id = call.data.split(':')[1]
+        response, keyboard = render_inbox_page(int(after_id) if after_id else None)
+        if response is None:
+            return
+
+        bot.edit_message_text(
+            response,
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+
+    def render_search_page(query, after=None):
+        """Текст и клавиатура одной страницы результатов поиска"""
+        hits, next_cursor = search_messages(query, after, SEARCH_PAGE_SIZE)
+        # Совпадения по именам показываем только на первой странице
+        users = search_users(query) if after is None else []
+        if not hits and not users:
+            return None, None
+
+        lines = [f"🔎 Поиск: {query}", ""]
+        if users:
+            lines.append("👥 Пользователи:")
+            for user_id, username, first_name, last_name in users:
+                username_display = f"@{username}" if username else "без username"
+                name_display = f"{first_name} {last_name}" if last_name else (first_name or "")
+                lines.append(f"{user_id} — {username_display} ({name_display}) /history {user_id}")
+            lines.append("")
+        if hits:
+            lines.append("💬 Сообщения:")
+            for msg_id, sender_id, receiver_id, sent_at, snippet, _ in hits:
+                # Собеседник администраторов — тот, кто не администратор
+                user_id = receiver_id if is_admin(sender_id) else sender_id
+                direction = "←" if is_admin(sender_id) else "→"
+                lines.append(f"[{sent_at[:16]}] {user_id} {direction} {snippet}")
+                lines.append(f"/history {user_id}")
+        response = "\n".join(lines)[:MAX_MESSAGE_LENGTH]
+
+        buttons = []
+        if after is not None:
+            buttons.append(telebot.types.InlineKeyboardButton("⏮ В начало", callback_data="search:"))
+        if next_cursor is not None:
+            rank, msg_id = next_cursor
+            buttons.append(telebot.types.InlineKeyboardButton(
+                "Вперёд ➡️", callback_data=f"search:{rank!r}:{msg_id}"))
+        if not buttons:
+            return response, None
+
+        keyboard = telebot.types.InlineKeyboardMarkup()
+        keyboard.add(*buttons)
+        return response, keyboard
+
+    @router.command('search')
+    def search(message):
+        """Полнотекстовый поиск по сообщениям и именам пользователей"""
+        if not is_admin(message.from_user.id):
+            return
+
+        parts = message.text.split(maxsplit=1)
+        if len(parts) < 2:
+            bot.reply_to(message, "Используйте: /search [запрос]")
+            return
+
+        response, keyboard = render_search_page(parts[1])
+        if response is None:
+            bot.reply_to(message, "Ничего не найдено.")
+            return
+
+        bot.reply_to(message, response, reply_markup=keyboard)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith('search:'))
+    @router.callback
+    def page_search(call):
+        """Листание результатов поиска"""
+        bot.answer_callback_query(call.id)
+        if not is_admin(call.from_user.id):
+            return
+
+        # Запрос не помещается в callback_data — берём его из исходной команды /search
+        command = call.message.reply_to_message
+        if command is None or not command.text:
+            return
+        parts = command.text.split(maxsplit=1)
+        if len(parts) < 2:
+            return
+
+        cursor = call.data.split(':')[1:]
+        after = (float(cursor[0]), int(cursor[1])) if cursor[0] else None
+        response, keyboard = render_search_page(parts[1], after)
+        if response is None:
+            return
+
+        bot.edit_message_text(
+            response,
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+
+    def render_history_page(user_id, before_id=None):
+        """Текст и клавиатура одной страницы истории сообщений"""
+        history, next_cursor = get_message_history_page(user_id, before_id, HISTORY_PAGE_SIZE)
+        if not history:
+            return None, None
+
+        header = f"История сообщений с пользователем {user_id}:\n\n"
+        entries = []
+        length = len(header)
+        # Страница приходит от новых к старым; если не помещается в сообщение,
+        # отбрасываем самые старые — они попадут на следующую страницу
+        for msg_id, sender_id, receiver_id, text, sent_at in history:
+            direction = "→" if sender_id == user_id else "←"
+            entry = f"[{sent_at[:19]}] {direction} {text}\n\n"
+            if entries and length + len(entry) > MAX_MESSAGE_LENGTH:
+                next_cursor = entries[-1][0]
+                break
+            entries.append((msg_id, entry))
+            length += len(entry)
+
+        response = (header + "".join(entry for _, entry in reversed(entries)))[:MAX_MESSAGE_LENGTH]
+
+        keyboard = telebot.types.InlineKeyboardMarkup()
+        buttons = []
+        if next_cursor is not None:
+            buttons.append(telebot.types.InlineKeyboardButton(
+                "⬅️ Старые", callback_data=f"history:{user_id}:{next_cursor}"))
+        if before_id is not None:
+            buttons.append(telebot.types.InlineKeyboardButton(
+                "⏩ Последние", callback_data=f"history:{user_id}:"))
+        keyboard.add(*buttons)
+        return response, keyboard if buttons else None
+
+    @router.command('history')
     def show_message_history(message):
         """История сообщений с пользователем"""
         if not is_admin(message.from_user.id):
@@ -77,23 +492,42 @@ def register_admin_handlers(bot):
 
         try:
             user_id = int(parts[1])
-            history = get_message_history(user_id)
+        except ValueError:
+            bot.reply_to(message, "Неверный формат user_id. Должно быть число.")
+            return
 
-            if not history:
-                bot.reply_to(message, f"Нет истории сообщений с пользователем {user_id}.")
-                return
+        response, keyboard = render_history_page(user_id)
+        if response is None:
+            bot.reply_to(message, f"Нет истории сообщений с пользователем {user_id}.")
+            return
 
-            response = f"История сообщений с пользователем {user_id}:\n\n"
-            for msg in history:
-                sender_id, receiver_id, text, sent_at = msg
-                direction = "→" if sender_id == user_id else "←"
-                response += f"[{sent_at[:19]}] {direction} {text}\n\n"
+        # Администратор открыл переписку — обращения пользователя закрепляются за ним
+        assign_support_thread(user_id, message.from_user.id)
 
-            bot.reply_to(message, response[:4000])  # Ограничение на длину сообщения
-        except ValueError:
-            bot.reply_to(message, "Неверный формат user_id. Должно быть число.")
+        bot.reply_to(message, response, reply_markup=keyboard)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith('history:'))
+    @router.callback
+    def page_message_history(call):
+        """Листание истории сообщений"""
+        if not is_admin(call.from_user.id):
+            bot.answer_callback_query(call.id)
+            return
+
+        _, user_id, before_id = call.data.split(':')
+        response, keyboard = render_history_page(int(user_id), int(before_id) if before_id else None)
+        bot.answer_callback_query(call.id)
+        if response is None:
+            return
 
-    @bot.message_handler(commands=['reply'])
+        bot.edit_message_text(
+            response,
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=keyboard
+        )
+
+    @router.command('reply')
     def admin_reply(message):
         """Ответ администратора пользователю"""
         if not is_admin(message.from_user.id):
@@ -108,21 +542,23 @@ def register_admin_handlers(bot):
             user_id = int(parts[1])
             reply_text = parts[2]
 
-            # Сохраняем сообщение в базу
-            add_message(message.from_user.id, user_id, reply_text)
-
             # Отправляем сообщение пользователю
             try:
                 bot.send_message(user_id, f"Сообщение от администратора:\n\n{reply_text}")
-                bot.reply_to(message, f"Сообщение пользователю {user_id} отправлено.")
             except Exception as e:
+                # Обращение остаётся открытым во /inbox — ответ не доставлен
                 bot.reply_to(message, f"Не удалось отправить сообщение: {str(e)}")
+                return
+
+            # Сохраняем ответ в базу и закрываем обращение
+            add_reply(message.from_user.id, user_id, reply_text)
+            bot.reply_to(message, f"Сообщение пользователю {user_id} отправлено.")
         except ValueError:
             bot.reply_to(message, "Неверный формат user_id. Должно быть число.")
 
-    @bot.message_handler(func=lambda message: not message.text.startswith('/') and 
-                                      is_admin(message.from_user.id) and 
-                                      len(message.text.split()) > 1)
+    @router.pattern(lambda message: not message.text.startswith('/') and
+                                    is_admin(message.from_user.id) and
+                                    len(message.text.split()) > 1)
     def handle_admin_message(message):
         """Обработка сообщений от администраторов без команд"""
         # Если сообщение начинается с числа (предполагаемый user_id), считаем это ответом пользователю
@@ -131,15 +567,17 @@ def register_admin_handlers(bot):
             user_id = int(parts[0])
             reply_text = parts[1]
 
-            # Сохраняем сообщение в базу
-            add_message(message.from_user.id, user_id, reply_text)
-
             # Отправляем сообщение пользователю
             try:
                 bot.send_message(user_id, f"Сообщение от администратора:\n\n{reply_text}")
-                bot.reply_to(message, f"Сообщение пользователю {user_id} отправлено.")
             except Exception as e:
+                # Обращение остаётся открытым во /inbox — ответ не доставлен
                 bot.reply_to(message, f"Не удалось отправить сообщение: {str(e)}")
+                return
+
+            # Сохраняем ответ в базу и закрываем обращение
+            add_reply(message.from_user.id, user_id, reply_text)
+            bot.reply_to(message, f"Сообщение пользователю {user_id} отправлено.")
         except (ValueError, IndexError):
             # Это не ответ пользователю, возможно, администратор просто пишет
             pass
\ No newline at end of file
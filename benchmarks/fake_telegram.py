@@ -0,0 +1,150 @@
+# benchmarks/fake_telegram.py
+"""
+Локальная замена Telegram Bot API для бенчмарков.
+
+Отвечает на sendMessage / sendDocument / sendVideo / getUpdates (и ещё
+несколько служебных методов) с настраиваемой задержкой и долей ответов 429.
+
+    server = FakeTelegramServer(latency=0.05, rate_limit_ratio=0.01)
+    server.start()
+    server.install()   # направить telebot на этот сервер
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from telebot import apihelper
+
+
+class FakeTelegramServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 rate_limit_ratio=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.rate_limited = 0
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._updates = []
+        self._updates_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-telegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def install(self):
+        """Направляет все запросы telebot на этот сервер"""
+        apihelper.API_URL = self.url + "/bot{0}/{1}"
+        apihelper.FILE_URL = self.url + "/file/bot{0}/{1}"
+
+    def push_updates(self, updates):
+        """Добавить обновления, которые вернёт getUpdates"""
+        with self._updates_lock:
+            self._updates.extend(updates)
+
+    def _take_updates(self, offset, limit):
+        with self._updates_lock:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            return self._updates[:limit]
+
+    def _message(self, chat_id, **extra):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id or 0), 'type': 'private'},
+        }
+        message.update(extra)
+        return message
+
+    def _file(self, **extra):
+        file_id = f"file{next(self._file_ids)}"
+        return dict(file_id=file_id, file_unique_id=file_id, **extra)
+
+    def _respond(self, method, params):
+        """Возвращает (HTTP-код, JSON-ответ) для вызова метода"""
+        with self._lock:
+            self.calls[method] += 1
+
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+        if method.startswith('send') and random.random() < self.rate_limit_ratio:
+            with self._lock:
+                self.rate_limited += 1
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            }
+
+        chat_id = params.get('chat_id')
+        if method == 'sendMessage':
+            result = self._message(chat_id, text=params.get('text', ''))
+        elif method == 'sendDocument':
+            result = self._message(chat_id, document=self._file())
+        elif method == 'sendVideo':
+            result = self._message(chat_id, video=self._file(width=1, height=1, duration=1))
+        elif method == 'editMessageText':
+            result = self._message(chat_id, text=params.get('text', ''))
+        elif method == 'getUpdates':
+            offset = int(params.get('offset', 0))
+            limit = int(params.get('limit', 100))
+            result = self._take_updates(offset, limit)
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        else:
+            # answerCallbackQuery, setWebhook, deleteWebhook и т.п.
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if body and self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+
+                status, payload = server._respond(method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
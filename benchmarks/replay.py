@@ -0,0 +1,182 @@
+# benchmarks/replay.py
+"""
+Воспроизведение записанного потока обновлений (recorder.py) через
+зарегистрированные обработчики бота.
+
+    python benchmarks/replay.py data/recordings/*.jsonl.gz --speed 10
+    python benchmarks/replay.py data/recordings/*.jsonl.gz --speed max --workers 16 --db bot.db
+
+Обновления подаются с исходными интервалами, ускоренными в --speed раз
+(max — без пауз), на временную копию базы и локальную замену Bot API.
+Отчёт (JSON): задержка в очереди и время обработчиков p50/p95/p99.
+"""
+import argparse
+import glob
+import json
+import os
+import queue
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import telebot
+import database
+from recorder import read_records
+from benchmarks.fake_telegram import FakeTelegramServer
+from benchmarks.run import make_bot, summarize
+
+_STOP = object()
+
+
+def copy_database(source, target):
+    """Консистентная копия базы (вместе с WAL) через backup API SQLite"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def replay(bot, records, speed, workers):
+    """
+    Подаёт обновления в очередь по расписанию записи; рабочие потоки
+    обрабатывают их. Возвращает отчёт по задержкам.
+    """
+    tasks = queue.Queue()
+    queue_delays = []
+    handler_latencies = []
+    errors = 0
+    max_backlog = 0
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal errors
+        while True:
+            item = tasks.get()
+            if item is _STOP:
+                return
+            scheduled_at, data = item
+            started = time.perf_counter()
+            try:
+                bot.process_new_updates([telebot.types.Update.de_json(data)])
+            except Exception:
+                with lock:
+                    errors += 1
+            finished = time.perf_counter()
+            with lock:
+                queue_delays.append(started - scheduled_at)
+                handler_latencies.append(finished - started)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    started = time.perf_counter()
+    first_t = None
+    count = 0
+    for t, data in records:
+        if first_t is None:
+            first_t = t
+        if speed is None:
+            scheduled_at = time.perf_counter()
+        else:
+            scheduled_at = started + (t - first_t) / speed
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        tasks.put((scheduled_at, data))
+        count += 1
+        max_backlog = max(max_backlog, tasks.qsize())
+
+    for _ in threads:
+        tasks.put(_STOP)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    recorded_span = (t - first_t) if first_t is not None else 0
+    return {
+        'updates': count,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 4),
+        'recorded_span_s': round(recorded_span, 3),
+        'throughput_per_s': round(count / elapsed, 2) if elapsed > 0 else None,
+        'max_backlog': max_backlog,
+        'queue_delay': summarize(queue_delays, elapsed),
+        'handler_latency': summarize(handler_latencies, elapsed),
+    }
+
+
+def parse_speed(value):
+    if value == 'max':
+        return None
+    speed = float(value.rstrip('x'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("скорость должна быть больше нуля")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='+', help='файлы записи (*.jsonl.gz)')
+    parser.add_argument('--speed', type=parse_speed, default=1.0, help='1, 10, 10x или max')
+    parser.add_argument('--workers', type=int, default=8, help='потоков обработки')
+    parser.add_argument('--db', default=database.DB_NAME, help='база, копия которой используется')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка ответа API, с')
+    parser.add_argument('--jitter', type=float, default=0.005, help='разброс задержки API, с')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='доля ответов 429 на send*')
+    parser.add_argument('--output', help='куда сохранить JSON (по умолчанию — stdout)')
+    args = parser.parse_args()
+
+    paths = [path for pattern in args.logs for path in glob.glob(pattern)]
+    if not paths:
+        parser.error("не найдено ни одного файла записи")
+
+    server = FakeTelegramServer(latency=args.latency, jitter=args.jitter,
+                                rate_limit_ratio=args.rate_limit_ratio)
+    server.start()
+    server.install()
+
+    scratch_dir = tempfile.mkdtemp(prefix='replay-')
+    scratch_db = os.path.join(scratch_dir, 'replay.db')
+    try:
+        if os.path.exists(args.db):
+            copy_database(args.db, scratch_db)
+        database.DB_NAME = scratch_db
+        database.init_db()
+        database.warm_user_cache()
+
+        bot = make_bot()
+        report = replay(bot, read_records(paths), args.speed, args.workers)
+        report['meta'] = {
+            'logs': sorted(paths),
+            'speed': 'max' if args.speed is None else args.speed,
+            'workers': args.workers,
+            'api_calls': dict(server.calls),
+            'api_rate_limited': server.rate_limited,
+        }
+    finally:
+        server.stop()
+        database.close_connection()
+        for name in os.listdir(scratch_dir):
+            os.remove(os.path.join(scratch_dir, name))
+        os.rmdir(scratch_dir)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
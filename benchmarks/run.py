@@ -0,0 +1,307 @@
+# benchmarks/run.py
+"""
+Офлайн-бенчмарки бота на локальной замене Telegram Bot API.
+
+    python benchmarks/run.py --users 100000 --latency 0.05 --output bench.json
+    python benchmarks/run.py --scenarios start_flood,broadcast --rate-limit-ratio 0.01
+
+Каждый сценарий работает с засеянной временной копией базы и печатает
+(или сохраняет в --output) JSON с пропускной способностью и p50/p95/p99,
+чтобы сравнивать результаты между запусками.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # пути к промо-материалам в config.py относительные
+
+import telebot
+import database
+from benchmarks.fake_telegram import FakeTelegramServer
+
+SCENARIOS = ('start_flood', 'promo_flood', 'payment_burst', 'admin_listings', 'broadcast')
+
+BOT_TOKEN = '123456:benchmark'
+ADMIN_ID = 676228432
+FIRST_NEW_USER_ID = 10 ** 9
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0, **extra):
+    latencies = sorted(latencies)
+    result = {
+        'count': len(latencies),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_per_s': round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        'p50_ms': None,
+        'p95_ms': None,
+        'p99_ms': None,
+    }
+    for key, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+        value = percentile(latencies, fraction)
+        result[key] = round(value * 1000, 3) if value is not None else None
+    result.update(extra)
+    return result
+
+
+def seed_database(users, interested_ratio, paid_ratio, messages_per_user, batch_size=10000):
+    """Заполняет пустую базу синтетическими пользователями"""
+    interested_every = max(1, round(1 / interested_ratio)) if interested_ratio else 0
+    paid_every = max(1, round(1 / paid_ratio)) if paid_ratio else 0
+
+    def batches(rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    with database.transaction() as cursor:
+        for batch in batches((i, f"user{i}", f"Имя{i}", None) for i in range(1, users + 1)):
+            cursor.executemany(
+                'INSERT INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)', batch)
+        if interested_every:
+            for batch in batches((i,) for i in range(1, users + 1, interested_every)):
+                cursor.executemany('INSERT INTO interested_users (user_id) VALUES (?)', batch)
+        if paid_every:
+            for batch in batches((i, f"PAY-{i:012d}") for i in range(1, users + 1, paid_every)):
+                cursor.executemany('INSERT INTO paid_users (user_id, payment_id) VALUES (?, ?)', batch)
+        if messages_per_user:
+            rows = (
+                (ADMIN_ID if n % 2 else i, i if n % 2 else ADMIN_ID, f"Сообщение {n} пользователя {i}")
+                for i in range(1, users + 1, 10)
+                for n in range(messages_per_user)
+            )
+            for batch in batches(rows):
+                cursor.executemany('INSERT INTO messages (sender_id, receiver_id, message) VALUES (?, ?, ?)', batch)
+
+
+def make_bot():
+    from user_handlers import register_user_handlers
+    from admin_handlers import register_admin_handlers
+
+    bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+    register_user_handlers(bot)
+    register_admin_handlers(bot)
+    return bot
+
+
+def text_update(update_id, user_id, text):
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f"bench{user_id}"},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def run_updates(bot, updates, concurrency):
+    """Прогоняет обновления через обработчики бота, замеряя время каждого"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def handle(data):
+        nonlocal errors
+        update = telebot.types.Update.de_json(data)
+        started = time.perf_counter()
+        try:
+            bot.process_new_updates([update])
+        except Exception:
+            with lock:
+                errors += 1
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(handle, updates))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def scenario_start_flood(bot, args):
+    updates = (text_update(i, FIRST_NEW_USER_ID + i, '/start') for i in range(args.requests))
+    return run_updates(bot, updates, args.concurrency)
+
+
+def scenario_promo_flood(bot, args):
+    # Половина нажатий — повторные от тех же пользователей
+    updates = (text_update(i, FIRST_NEW_USER_ID + i // 2, '🎬 Промо') for i in range(args.requests))
+    return run_updates(bot, updates, args.concurrency)
+
+
+def scenario_payment_burst(bot, args):
+    updates = (
+        text_update(i, 2 * FIRST_NEW_USER_ID + i, f"Мой ID платежа PAY-{i:012d}")
+        for i in range(args.requests)
+    )
+    return run_updates(bot, updates, args.concurrency)
+
+
+def scenario_admin_listings(bot, args):
+    """Полный проход по /users и /paid страницами"""
+    latencies = []
+    pages = 0
+    started = time.perf_counter()
+    for roster in ('interested_users', 'paid_users'):
+        after_id = None
+        while True:
+            page_started = time.perf_counter()
+            rows, _, has_next = database.get_roster_page(roster, after_id=after_id)
+            latencies.append(time.perf_counter() - page_started)
+            pages += 1
+            if not has_next:
+                break
+            after_id = rows[-1][0]
+
+    # И один вызов /users через обработчик целиком
+    update = text_update(1, ADMIN_ID, '/users')
+    handler = run_updates(bot, [update], 1)
+    return summarize(latencies, time.perf_counter() - started, pages=pages, users_command_ms=handler['p50_ms'])
+
+
+class _TimedBot:
+    """Обёртка бота для рассылки: замеряет время каждого send_message"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def send_message(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.bot.send_message(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.latencies.append(elapsed)
+
+
+def scenario_broadcast(bot, args):
+    from broadcast import Broadcaster, DeliveryCheckpoint
+
+    job_id = database.create_broadcast_job("Бенчмарк рассылки")
+    recipients = list(itertools.islice(database.iter_pending_deliveries(job_id), args.broadcast_limit or None))
+
+    timed = _TimedBot(bot)
+    checkpoint = DeliveryCheckpoint(job_id)
+    started = time.perf_counter()
+    stats = Broadcaster(timed, rate=args.broadcast_rate, per_chat_rate=args.broadcast_rate).run(
+        recipients, "Бенчмарк рассылки", on_result=checkpoint)
+    checkpoint.flush()
+    elapsed = time.perf_counter() - started
+    return summarize(timed.latencies, elapsed, stats.failed, recipients=len(recipients),
+                     sent=stats.sent, retried=stats.retried, rate_limited=stats.rate_limited,
+                     delivered_per_s=round(stats.sent / elapsed, 2) if elapsed > 0 else None)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='сценарии через запятую')
+    parser.add_argument('--users', type=int, default=10000, help='размер засеянной базы (10k–1M)')
+    parser.add_argument('--interested-ratio', type=float, default=0.6)
+    parser.add_argument('--paid-ratio', type=float, default=0.05)
+    parser.add_argument('--messages-per-user', type=int, default=4, help='сообщений у каждого 10-го пользователя')
+    parser.add_argument('--requests', type=int, default=2000, help='обновлений в сценариях наплыва')
+    parser.add_argument('--concurrency', type=int, default=8, help='параллельных обработчиков')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка ответа API, с')
+    parser.add_argument('--jitter', type=float, default=0.005, help='разброс задержки API, с')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='доля ответов 429 на send*')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--broadcast-rate', type=float, default=1000.0, help='лимит рассылки, сообщ./с')
+    parser.add_argument('--broadcast-limit', type=int, default=0, help='ограничить число получателей (0 — все)')
+    parser.add_argument('--db', help='путь к временной базе (по умолчанию — во временном каталоге)')
+    parser.add_argument('--output', help='куда сохранить JSON (по умолчанию — stdout)')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    server = FakeTelegramServer(latency=args.latency, jitter=args.jitter,
+                                rate_limit_ratio=args.rate_limit_ratio, retry_after=args.retry_after)
+    server.start()
+    server.install()
+
+    db_dir = None
+    if args.db:
+        database.DB_NAME = args.db
+    else:
+        db_dir = tempfile.mkdtemp(prefix='bench-')
+        database.DB_NAME = os.path.join(db_dir, 'bench.db')
+
+    report = {
+        'meta': {
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'args': vars(args),
+        },
+        'results': {},
+    }
+
+    try:
+        database.init_db()
+        seed_started = time.perf_counter()
+        seed_database(args.users, args.interested_ratio, args.paid_ratio, args.messages_per_user)
+        report['meta']['seed_s'] = round(time.perf_counter() - seed_started, 3)
+        database.warm_user_cache()
+
+        bot = make_bot()
+        for name in scenarios:
+            print(f"▶ {name}...", file=sys.stderr)
+            report['results'][name] = globals()[f"scenario_{name}"](bot, args)
+        report['meta']['api_calls'] = dict(server.calls)
+        report['meta']['api_rate_limited'] = server.rate_limited
+    finally:
+        server.stop()
+        database.close_connection()
+        if db_dir:
+            for name in os.listdir(db_dir):
+                os.remove(os.path.join(db_dir, name))
+            os.rmdir(db_dir)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,76 @@
 # bot.py
 import telebot
-from config import BOT_TOKEN, SALE_START_DATE
-from database import init_db
+from config import BOT_TOKEN, SALE_START_DATE, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, RECORD_UPDATES
+from database import init_db, warm_user_cache, start_write_behind, stop_write_behind
 from scheduler import start_scheduler
 from user_handlers import register_user_handlers
 from admin_handlers import register_admin_handlers
-from keep_alive import keep_alive  # ← импортируем функцию
+from keep_alive import keep_alive, enable_webhook  # ← импортируем функцию
+from metrics import install_telegram_metrics
+from recorder import UpdateRecorder
+from manual_delivery import manual_delivery
 from datetime import datetime
 import time
 import threading
+import signal
 import os
 
 def main():
     # Инициализация базы данных
     init_db()
+    print(f"Кэш пользователей заполнен: {warm_user_cache()} записей")
+    start_write_behind()
 
-    # Запуск keep_alive для предотвращения засыпания
-    # ВАЖНО: сохраняем результат, чтобы поток не завершился
-    keep_alive()  # ← эта функция запускает Flask-сервер в отдельном потоке
+    # Замер времени и кодов ответа всех запросов к Telegram
+    install_telegram_metrics()
 
     # Создание бота
-    bot = telebot.TeleBot(BOT_TOKEN)
+    # В режиме webhook обработчики выполняются в потоках keep_alive,
+    # поэтому собственный пул потоков telebot не нужен
+    bot = telebot.TeleBot(BOT_TOKEN, threaded=BOT_MODE != 'webhook')
+
+    # Запись входящих обновлений (обезличенных) для нагрузочных тестов
+    recorder = UpdateRecorder().attach(bot) if RECORD_UPDATES else None
+
+    # При деплое процесс останавливают сигналом: atexit при этом не срабатывает
+    # (а поток Flask не даёт процессу завершиться штатно), поэтому отложенные
+    # записи и файл записи обновлений сохраняем в обработчике сигнала
+    def shutdown(signum, frame):
+        print(f"Получен сигнал {signum}, завершаем работу...")
+        stop_write_behind()
+        if recorder is not None:
+            recorder.close()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
 
     # Регистрация обработчиков
     register_user_handlers(bot)
     register_admin_handlers(bot)
 
+    if BOT_MODE == 'webhook':
+        enable_webhook(bot)  # ← маршрут нужно добавить до запуска Flask
+
+    # Запуск keep_alive для предотвращения засыпания
+    # ВАЖНО: сохраняем результат, чтобы поток не завершился
+    server = keep_alive()  # ← эта функция запускает Flask-сервер в отдельном потоке
+
+    # Выдача методички оплатившим
+    manual_delivery.start(bot)
+
     # Запуск планировщика
     scheduler = start_scheduler(bot)  # ← передаём bot в планировщик
 
     # Запуск бота
-    print("Бот запущен и работает 24/7...")
-    bot.infinity_polling()
+    if BOT_MODE == 'webhook':
+        bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+        print("Бот запущен в режиме webhook и работает 24/7...")
+        server.join()
+    else:
+        bot.remove_webhook()
+        print("Бот запущен и работает 24/7...")
+        bot.infinity_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
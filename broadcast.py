@@ -0,0 +1,338 @@
+# broadcast.py
+import queue
+import threading
+import time
+from requests.exceptions import RequestException
+from telebot.apihelper import ApiTelegramException
+from config import (
+    BROADCAST_RATE,
+    BROADCAST_PER_CHAT_RATE,
+    BROADCAST_WORKERS,
+    BROADCAST_MAX_RETRIES,
+    BROADCAST_CHECKPOINT_BATCH,
+    BROADCAST_WINDOW_MINUTES,
+    BROADCAST_SLOTS
+)
+from metrics import BROADCAST_MESSAGES, BROADCAST_THROUGHPUT, BROADCAST_PENDING, BROADCAST_RUNNING
+from database import (
+    create_broadcast_job,
+    get_broadcast_job,
+    get_unfinished_broadcast_jobs,
+    get_pending_slots,
+    iter_pending_deliveries,
+    save_delivery_results,
+    finish_broadcast_job
+)
+
+# Базовая задержка (в секундах) для повторов при временных ошибках
+RETRY_BACKOFF = 1.0
+
+# Маркер завершения очереди для рабочих потоков
+_STOP = object()
+
+# Описания ошибок 403, после которых писать пользователю бессмысленно
+UNREACHABLE_ERRORS = ('blocked', 'deactivated')
+
+_SENT = BROADCAST_MESSAGES.labels('sent')
+_FAILED = BROADCAST_MESSAGES.labels('failed')
+_RETRIED = BROADCAST_MESSAGES.labels('retried')
+_RATE_LIMITED = BROADCAST_MESSAGES.labels('rate_limited')
+_UNREACHABLE = BROADCAST_MESSAGES.labels('unreachable')
+
+# Рассылки выполняются по одной, чтобы не делить между собой лимиты Telegram
+_broadcast_lock = threading.Lock()
+
+
+def is_unreachable(error):
+    """Пользователь заблокировал бота или удалил аккаунт"""
+    return (
+        isinstance(error, ApiTelegramException)
+        and error.error_code == 403
+        and any(reason in error.description.lower() for reason in UNREACHABLE_ERRORS)
+    )
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: не более rate операций в секунду"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Блокирует поток, пока не появится свободный токен"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов на seconds секунд (ответ 429 от Telegram)"""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0
+            self._updated = max(now, self._paused_until)
+
+
+class BroadcastStats:
+    """Итоги рассылки"""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.unreachable = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def add(self, field, value=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + value)
+
+    def merge(self, other):
+        """Добавить счётчики другой рассылки (итоги по нескольким слотам)"""
+        for field in ('sent', 'failed', 'unreachable', 'retried', 'rate_limited'):
+            self.add(field, getattr(other, field))
+
+    @property
+    def elapsed(self):
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def throughput(self):
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (f"отправлено {self.sent}, ошибок {self.failed}, недоступны {self.unreachable}, "
+                f"повторов {self.retried}, "
+                f"429 получено {self.rate_limited}, время {self.elapsed:.1f} с, "
+                f"скорость {self.throughput:.1f} сообщ./с")
+
+
+class Broadcaster:
+    """
+    Рассылка сообщений пулом потоков с учётом лимитов Telegram:
+    общий лимит (~30 сообщ./с) и лимит на один чат, retry_after при 429
+    и повторы с экспоненциальной задержкой при временных ошибках.
+    """
+
+    def __init__(self, bot, rate=BROADCAST_RATE, per_chat_rate=BROADCAST_PER_CHAT_RATE,
+                 workers=BROADCAST_WORKERS, max_retries=BROADCAST_MAX_RETRIES):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.workers = workers
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(rate)
+        self._chat_buckets = {}
+        self._chat_buckets_lock = threading.Lock()
+
+    def _chat_bucket(self, chat_id):
+        with self._chat_buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, capacity=1)
+            return bucket
+
+    def _forget_chat(self, chat_id):
+        with self._chat_buckets_lock:
+            self._chat_buckets.pop(chat_id, None)
+
+    def _deliver(self, chat_id, text, stats, kwargs):
+        """Отправляет одно сообщение; возвращает None при успехе или последнюю ошибку"""
+        attempt = 0
+        while True:
+            self._chat_bucket(chat_id).acquire()
+            self.global_bucket.acquire()
+            try:
+                self.bot.send_message(chat_id, text, **kwargs)
+                return None
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+                    stats.add('rate_limited')
+                    _RATE_LIMITED.inc()
+                    self.global_bucket.pause(retry_after)
+                    continue
+                if e.error_code < 500 or attempt >= self.max_retries:
+                    return e
+                error = e
+            except RequestException as e:
+                if attempt >= self.max_retries:
+                    return e
+                error = e
+
+            attempt += 1
+            stats.add('retried')
+            _RETRIED.inc()
+            print(f"Повтор отправки пользователю {chat_id} (попытка {attempt}): {error}")
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+
+    def _worker(self, tasks, text, stats, on_result, kwargs):
+        while True:
+            chat_id = tasks.get()
+            if chat_id is _STOP:
+                return
+            try:
+                error = self._deliver(chat_id, text, stats, kwargs)
+            except Exception as e:
+                # Неожиданная ошибка (не API и не сети) — считаем неудачной доставкой:
+                # погибший поток оставил бы run() навсегда ждать в tasks.put()
+                error = e
+            self._forget_chat(chat_id)
+            if error is None:
+                stats.add('sent')
+                _SENT.inc()
+            elif is_unreachable(error):
+                stats.add('unreachable')
+                _UNREACHABLE.inc()
+            else:
+                stats.add('failed')
+                _FAILED.inc()
+                print(f"Не удалось отправить сообщение пользователю {chat_id}: {error}")
+            if on_result:
+                try:
+                    on_result(chat_id, error)
+                except Exception as e:
+                    # Например, database is locked при записи контрольной точки:
+                    # результаты остаются в DeliveryCheckpoint и запишутся следующей пачкой
+                    print(f"❌ Ошибка обработки результата доставки пользователю {chat_id}: {e}")
+
+    def run(self, user_ids, text, on_result=None, **kwargs):
+        """
+        Рассылает text всем user_ids и возвращает BroadcastStats.
+        on_result(user_id, error) вызывается после каждой попытки доставки.
+        """
+        stats = BroadcastStats()
+        tasks = queue.Queue(maxsize=self.workers * 4)
+        threads = [
+            threading.Thread(target=self._worker, args=(tasks, text, stats, on_result, kwargs), daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        for user_id in user_ids:
+            tasks.put(user_id)
+        for _ in threads:
+            tasks.put(_STOP)
+        for thread in threads:
+            thread.join()
+
+        stats.finished_at = time.monotonic()
+        BROADCAST_THROUGHPUT.set(stats.throughput)
+        print(f"📨 Отправка завершена: {stats}")
+        return stats
+
+
+class DeliveryCheckpoint:
+    """Накапливает результаты доставки и записывает их в базу пачками"""
+
+    def __init__(self, job_id, batch_size=BROADCAST_CHECKPOINT_BATCH):
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self._results = []
+        self._lock = threading.Lock()
+
+    def __call__(self, user_id, error):
+        if error is None:
+            status = 'sent'
+        elif is_unreachable(error):
+            status = 'unreachable'
+        else:
+            status = 'failed'
+        BROADCAST_PENDING.dec()
+        with self._lock:
+            self._results.append((user_id, status, None if error is None else str(error)))
+            if len(self._results) >= self.batch_size:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._results:
+            # При ошибке записи пачка не очищается и уйдёт в базу со следующей
+            save_delivery_results(self.job_id, self._results)
+            self._results = []
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+
+def run_broadcast_job(bot, job_id):
+    """
+    Доставляет рассылку всем получателям, которым она ещё не отправлена.
+    Слоты отправляются по очереди, каждый в свою часть окна рассылки и
+    со скоростью, растягивающей его на эту часть: нагрузка на API ровная,
+    а лимиты остаются и для ответов живым пользователям.
+    """
+    with _broadcast_lock:
+        message, created_at, slots, window_seconds = get_broadcast_job(job_id)
+        slot_seconds = window_seconds / slots
+        pending_slots = get_pending_slots(job_id)
+        print(f"📨 Рассылка #{job_id}: осталось получателей {sum(count for _, count in pending_slots)}, "
+              f"слотов {len(pending_slots)} из {slots}")
+
+        stats = BroadcastStats()
+        checkpoint = DeliveryCheckpoint(job_id)
+        BROADCAST_RUNNING.set(1)
+        BROADCAST_PENDING.set(sum(count for _, count in pending_slots))
+        try:
+            for slot, count in pending_slots:
+                # После перезапуска пропущенные слоты отправляются сразу
+                delay = created_at + slot * slot_seconds - time.time()
+                if delay > 0:
+                    print(f"📨 Рассылка #{job_id}: слот {slot + 1}/{slots} через {delay:.0f} с")
+                    time.sleep(delay)
+
+                rate = BROADCAST_RATE
+                if slot_seconds:
+                    rate = min(BROADCAST_RATE, max(1.0, count / slot_seconds))
+                # Получатели читаются пачками по мере отправки, а не списком целиком
+                pending = iter_pending_deliveries(job_id, slot)
+                stats.merge(Broadcaster(bot, rate=rate).run(pending, message, on_result=checkpoint))
+                checkpoint.flush()
+        finally:
+            checkpoint.flush()
+            stats.finished_at = time.monotonic()
+            BROADCAST_RUNNING.set(0)
+            BROADCAST_PENDING.set(0)
+
+        finish_broadcast_job(job_id)
+        print(f"📨 Рассылка #{job_id} завершена: {stats}")
+        return stats
+
+
+def start_broadcast(bot, message, segment='interested', window_minutes=BROADCAST_WINDOW_MINUTES):
+    """
+    Создаёт рассылку по сегменту пользователей (см. database.SEGMENTS)
+    и выполняет её, разнося слоты получателей по окну в window_minutes минут
+    """
+    slots = BROADCAST_SLOTS if window_minutes else 1
+    job_id = create_broadcast_job(message, segment, slots, window_minutes * 60)
+    return run_broadcast_job(bot, job_id)
+
+
+def resume_broadcasts(bot):
+    """Продолжает рассылки, прерванные перезапуском процесса"""
+    for job_id, message in get_unfinished_broadcast_jobs():
+        print(f"🔁 Возобновление рассылки #{job_id}")
+        run_broadcast_job(bot, job_id)
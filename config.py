@@ -20,21 +20,86 @@ PROMO_VIDEO_PATH = 'data/promo/promo_video.m4v'
 PROMO_DOC_PATH = 'data/promo/promo_document.pdf'
 MANUAL_PATH = 'data/manual/medical_metrics_manual.pdf'
 
+# Режим получения обновлений: 'polling' или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Параметры webhook (Telegram шлёт обновления на WEBHOOK_URL + WEBHOOK_PATH)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')        # Публичный адрес сервера, например https://bot.example.com
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = 8            # Потоки обработки обновлений
+WEBHOOK_QUEUE_SIZE = 1000      # Сколько обновлений может ждать обработки
+
+# Печатать решения маршрутизатора сообщений (для отладки)
+ROUTER_DEBUG = os.getenv('ROUTER_DEBUG', '0') == '1'
+
+# Защита от флуда: лимит сообщений на пользователя (администраторы не ограничиваются)
+FLOOD_RATE = 1.0               # Сообщений в секунду в среднем
+FLOOD_BURST = 5                # Сколько сообщений можно отправить подряд
+FLOOD_DUPLICATE_WINDOW = 3.0   # Одинаковые сообщения чаще этого (секунды) отбрасываются
+FLOOD_MAX_USERS = 50000        # Сколько пользователей отслеживать одновременно
+FLOOD_IDLE_TTL = 600           # Через сколько секунд тишины состояние пользователя забывается
+
+# Профилирование (/profile) и журнал медленных обработчиков
+PROFILE_MAX_SECONDS = 300      # Максимальная длительность замера
+PROFILE_INTERVAL = 0.005       # Период снятия стеков (секунды)
+PROFILE_TOP_N = 20             # Сколько функций показывать в отчёте
+SLOW_HANDLER_THRESHOLD = 1.0   # Обработчики дольше этого (секунды) попадают в журнал
+
+# Запись входящих обновлений для последующего воспроизведения (benchmarks/replay.py)
+RECORD_UPDATES = os.getenv('RECORD_UPDATES', '0') == '1'
+RECORD_DIR = 'data/recordings'
+RECORD_SALT = os.getenv('RECORD_SALT', '')     # Ключ для псевдонимов id (если не задан — из RECORD_SALT_FILE)
+RECORD_SALT_FILE = 'data/recordings/salt'      # Создаётся при первом запуске, чтобы псевдонимы не менялись
+RECORD_MAX_BYTES = 50 * 1024 * 1024  # Размер файла (до сжатия), после которого начинается новый
+RECORD_BACKUP_COUNT = 20             # Сколько старых файлов хранить
+
 # Ссылка на оплату
 PAYMENT_URL = "https://vk.com/gorilla_shigella"
 
 # Период уведомлений (в часах)
 NOTIFICATION_INTERVAL = 24
 
-def get_time_until_sale():
-    """Возвращает оставшееся время до старта продаж в виде строки"""
-    now = datetime.now()
-    if now >= SALE_START_DATE:
-        return "уже начались"
+# Кому отправлять периодические уведомления (сегмент из database.SEGMENTS):
+# оплатившим напоминания о продажах не нужны
+NOTIFICATION_SEGMENT = 'interested_not_paid'
+
+# Сколько секунд пропущенное уведомление ещё можно отправить с опозданием
+NOTIFICATION_MISFIRE_GRACE = 3600
+
+# Обращения пользователей к администраторам
+INBOX_PAGE_SIZE = 10           # Обращений на одной странице /inbox
+SUPPORT_DIGEST_MINUTES = 30    # Как часто присылать администраторам сводку новых обращений
+
+# Сколько результатов показывать на одной странице /search
+SEARCH_PAGE_SIZE = 10
+
+# Сколько сообщений показывать на одной странице /history
+HISTORY_PAGE_SIZE = 20
+
+# Сколько пользователей показывать на одной странице /users и /paid
+ROSTER_PAGE_SIZE = 50
+
+# Размер кэша статусов пользователей (известен / заинтересован / оплатил)
+USER_CACHE_SIZE = 100000
+
+# Отложенная пакетная запись /start и /promo в базу
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', '0') == '1'
+WRITE_BEHIND_BATCH_SIZE = 500      # Записать пачку, когда накопилось столько строк
+WRITE_BEHIND_FLUSH_INTERVAL = 1.0  # ...или прошло столько секунд
 
-    delta = SALE_START_DATE - now
-    days = delta.days
-    hours = delta.seconds // 3600
-    minutes = (delta.seconds % 3600) // 60
+# Параметры рассылки
+BROADCAST_RATE = 28            # Общий лимит сообщений в секунду (у Telegram ~30)
+BROADCAST_PER_CHAT_RATE = 1    # Лимит сообщений в секунду в один чат
+BROADCAST_WORKERS = 8          # Количество потоков отправки
+BROADCAST_MAX_RETRIES = 3      # Повторы при временных ошибках
+BROADCAST_CHECKPOINT_BATCH = 100  # Сколько результатов доставки записывать в базу за раз
+BROADCAST_WINDOW_MINUTES = 120  # За сколько минут разнести рассылку (0 — отправить сразу всем)
+BROADCAST_SLOTS = 12            # На сколько слотов делить получателей внутри окна
+BROADCAST_FETCH_BATCH = 1000    # Сколько id получателей читать из базы за один запрос
 
-    return f"{days} дней, {hours} часов, {minutes} минут"
\ No newline at end of file
+# Очередь выдачи методички оплатившим
+MANUAL_DELIVERY_WORKERS = 2         # Потоков отправки
+MANUAL_DELIVERY_MAX_ATTEMPTS = 5    # После стольких неудач выдача передаётся администратору
+MANUAL_DELIVERY_BACKOFF = 30        # Задержка перед первым повтором (с), дальше удваивается
+MANUAL_DELIVERY_POLL_INTERVAL = 5   # Как часто проверять очередь без явного сигнала (с)
@@ -1,187 +1,1180 @@
 # database.py
 import sqlite3
 import os
+import re
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+import atexit
+from config import (
+    WRITE_BEHIND_ENABLED,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_INTERVAL,
+    BROADCAST_FETCH_BATCH
+)
+from metrics import timed_query
+from user_cache import user_cache, UserStatus
+from write_behind import WriteBehindQueue
 
 DB_NAME = 'bot.db'
 
-def init_db():
-    """Инициализация базы данных"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+# Параметры соединения с SQLite
+DB_BUSY_TIMEOUT = 5000         # Сколько ждать снятия блокировки (мс)
+DB_CACHE_SIZE_KB = 8192        # Размер кэша страниц на соединение
+DB_CACHED_STATEMENTS = 256     # Сколько подготовленных запросов держать на соединение
 
-    # Таблица пользователей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT,
-        first_name TEXT,
-        last_name TEXT,
-        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
+# Одно соединение на поток: polling, планировщик и Flask не делят соединения
+_local = threading.local()
 
-    # Таблица заинтересованных пользователей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS interested_users (
-        user_id INTEGER PRIMARY KEY,
-        interested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
+def _connect():
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=DB_BUSY_TIMEOUT / 1000,
+        cached_statements=DB_CACHED_STATEMENTS
     )
-    ''')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
 
-    # Таблица оплативших пользователей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS paid_users (
-        user_id INTEGER PRIMARY KEY,
-        paid_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        payment_id TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
+def get_connection():
+    """Возвращает соединение текущего потока (создаётся при первом обращении)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.db_name != DB_NAME:
+        if conn is not None:
+            conn.close()
+        conn = _connect()
+        _local.conn = conn
+        _local.db_name = DB_NAME
+    return conn
+
+def close_connection():
+    """Закрыть соединение текущего потока"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def transaction(immediate=False):
+    """
+    Курсор в транзакции: commit при успехе, rollback при исключении.
+    immediate=True берёт блокировку записи сразу (BEGIN IMMEDIATE), чтобы проверка
+    SELECT и следующая за ней запись были атомарны: без этого sqlite3 начинает
+    транзакцию только перед первым INSERT/UPDATE.
+    """
+    conn = get_connection()
+    with conn:
+        if immediate:
+            conn.execute('BEGIN IMMEDIATE')
+        yield conn.cursor()
+
+# Очередь отложенной записи для add_user / mark_as_interested (см. start_write_behind)
+_write_queue = None
+
+@timed_query
+def _flush_pending_writes(pending):
+    """Записать накопленные upsert'ы одной транзакцией"""
+    users = pending.get('users', {})
+    interested = pending.get('interested_users', {})
+
+    with transaction() as cursor:
+        cursor.executemany('''
+        INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+        VALUES (?, ?, ?, ?)
+        ''', [(user_id,) + row for user_id, row in users.items()])
+        # Пользователь снова написал боту — значит, он его не блокирует
+        cursor.executemany('''
+        DELETE FROM unreachable_users WHERE user_id = ?
+        ''', [(user_id,) for user_id in users])
+        cursor.executemany('''
+        INSERT OR IGNORE INTO interested_users (user_id)
+        VALUES (?)
+        ''', [(user_id,) for user_id in interested])
+
+def start_write_behind():
+    """Включить отложенную пакетную запись (если WRITE_BEHIND_ENABLED)"""
+    global _write_queue
+    if not WRITE_BEHIND_ENABLED or _write_queue is not None:
+        return
+    _write_queue = WriteBehindQueue(
+        _flush_pending_writes,
+        WRITE_BEHIND_BATCH_SIZE,
+        WRITE_BEHIND_FLUSH_INTERVAL,
+        on_flushed=lambda pending: user_cache.bump_generation()
     )
-    ''')
+    _write_queue.start()
+    atexit.register(stop_write_behind)
 
-    # Таблица сообщений между админами и пользователями
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sender_id INTEGER NOT NULL,
-        receiver_id INTEGER NOT NULL,
-        message TEXT NOT NULL,
-        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+def stop_write_behind():
+    """Остановить отложенную запись, синхронно записав остаток"""
+    global _write_queue
+    if _write_queue is not None:
+        queue, _write_queue = _write_queue, None
+        queue.stop()
+
+def flush_pending_writes():
+    """Синхронно записать всё, что ждёт в очереди отложенной записи"""
+    if _write_queue is not None:
+        _write_queue.flush()
+
+def _pending_status(user_id):
+    """Статус пользователя по ещё не записанным в базу изменениям"""
+    if _write_queue is None:
+        return UserStatus(False, False, False)
+    return UserStatus(
+        _write_queue.contains('users', user_id),
+        _write_queue.contains('interested_users', user_id),
+        # Оплаты записываются только синхронно (см. add_payment)
+        False
     )
-    ''')
 
-    conn.commit()
-    conn.close()
+# Миграции схемы: MIGRATIONS[n] переводит базу с версии n на версию n + 1.
+# Текущая версия хранится в PRAGMA user_version. Новые миграции — только в конец списка.
+MIGRATIONS = [
+    # 1: исходная схема
+    [
+        # Таблица пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Таблица заинтересованных пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS interested_users (
+            user_id INTEGER PRIMARY KEY,
+            interested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Таблица оплативших пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS paid_users (
+            user_id INTEGER PRIMARY KEY,
+            paid_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            payment_id TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Таблица сообщений между админами и пользователями
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER NOT NULL,
+            receiver_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Кэш file_id загруженных в Telegram файлов
+        '''
+        CREATE TABLE IF NOT EXISTS media_cache (
+            path TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (path, content_hash)
+        )
+        ''',
+        # Рассылки и состояние доставки по каждому получателю
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (job_id, user_id),
+            FOREIGN KEY (job_id) REFERENCES broadcast_jobs (id)
+        )
+        ''',
+    ],
+    # 2: индексы для выборки истории сообщений по пользователю
+    [
+        'CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages (receiver_id, id)',
+    ],
+    # 3: сегменты рассылок и пользователи, до которых нельзя достучаться
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS unreachable_users (
+            user_id INTEGER PRIMARY KEY,
+            reason TEXT,
+            marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        "ALTER TABLE broadcast_jobs ADD COLUMN segment TEXT NOT NULL DEFAULT 'interested'",
+    ],
+    # 4: доставка рассылки слотами, разнесёнными по окну времени
+    [
+        'ALTER TABLE broadcast_jobs ADD COLUMN slots INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE broadcast_jobs ADD COLUMN window_seconds INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE broadcast_deliveries ADD COLUMN slot INTEGER NOT NULL DEFAULT 0',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_slot
+        ON broadcast_deliveries (job_id, status, slot)
+        ''',
+    ],
+    # 5: очередь выдачи методички, не больше одной выдачи на пользователя и на платёж
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS manual_deliveries (
+            user_id INTEGER PRIMARY KEY,
+            payment_id TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivered_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_manual_deliveries_due ON manual_deliveries (status, next_attempt_at)',
+        # Уже оплатившие получили методичку в обработчике — считаем выданной
+        '''
+        INSERT OR IGNORE INTO manual_deliveries (user_id, payment_id, status, delivered_at)
+        SELECT user_id, COALESCE(payment_id, 'user-' || user_id), 'sent', paid_at
+        FROM paid_users
+        ''',
+    ],
+    # 6: входящие обращения пользователей: 'new' (ещё не было в сводке) -> 'unread' -> 'answered'
+    [
+        'ALTER TABLE messages ADD COLUMN status TEXT',
+        'ALTER TABLE messages ADD COLUMN assigned_to INTEGER',
+        # Частичные индексы содержат только открытые обращения и остаются маленькими
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_open
+        ON messages (sender_id, id) WHERE status IN ('new', 'unread')
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_messages_new ON messages (id) WHERE status = 'new'",
+    ],
+    # 7: полнотекстовый поиск по сообщениям и именам пользователей (FTS5).
+    # Индексы внешнего содержимого хранят только токены; триггеры держат их в актуальном состоянии
+    [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            message,
+            content='messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+            INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+        END
+        ''',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            username, first_name, last_name,
+            content='users', content_rowid='user_id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, username, first_name, last_name)
+            VALUES (new.user_id, new.username, new.first_name, new.last_name);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, first_name, last_name)
+            VALUES ('delete', old.user_id, old.username, old.first_name, old.last_name);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_fts_update
+        AFTER UPDATE OF username, first_name, last_name ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, first_name, last_name)
+            VALUES ('delete', old.user_id, old.username, old.first_name, old.last_name);
+            INSERT INTO users_fts (rowid, username, first_name, last_name)
+            VALUES (new.user_id, new.username, new.first_name, new.last_name);
+        END
+        ''',
+        # Индексация уже накопленных данных
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+        "INSERT INTO users_fts (users_fts) VALUES ('rebuild')",
+    ],
+    # 8: воронка по дням (по местному времени), обновляется триггерами при каждой записи
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            joined INTEGER NOT NULL DEFAULT 0,
+            interested INTEGER NOT NULL DEFAULT 0,
+            paid INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS daily_stats_joined AFTER INSERT ON users BEGIN
+            INSERT INTO daily_stats (day, joined) VALUES (date('now', 'localtime'), 1)
+            ON CONFLICT (day) DO UPDATE SET joined = joined + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS daily_stats_interested AFTER INSERT ON interested_users BEGIN
+            INSERT INTO daily_stats (day, interested) VALUES (date('now', 'localtime'), 1)
+            ON CONFLICT (day) DO UPDATE SET interested = interested + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS daily_stats_paid AFTER INSERT ON paid_users BEGIN
+            INSERT INTO daily_stats (day, paid) VALUES (date('now', 'localtime'), 1)
+            ON CONFLICT (day) DO UPDATE SET paid = paid + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS daily_stats_delivered AFTER UPDATE OF status ON broadcast_deliveries
+        WHEN new.status = 'sent' AND old.status <> 'sent' BEGIN
+            INSERT INTO daily_stats (day, delivered) VALUES (date('now', 'localtime'), 1)
+            ON CONFLICT (day) DO UPDATE SET delivered = delivered + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS daily_stats_blocked AFTER INSERT ON unreachable_users BEGIN
+            INSERT INTO daily_stats (day, blocked) VALUES (date('now', 'localtime'), 1)
+            ON CONFLICT (day) DO UPDATE SET blocked = blocked + 1;
+        END
+        ''',
+        # Заполнение по уже накопленным данным
+        '''
+        INSERT INTO daily_stats (day, joined)
+        SELECT date(joined_at, 'localtime'), COUNT(*) FROM users WHERE joined_at IS NOT NULL GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET joined = joined + excluded.joined
+        ''',
+        '''
+        INSERT INTO daily_stats (day, interested)
+        SELECT date(interested_at, 'localtime'), COUNT(*) FROM interested_users WHERE interested_at IS NOT NULL GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET interested = interested + excluded.interested
+        ''',
+        '''
+        INSERT INTO daily_stats (day, paid)
+        SELECT date(paid_at, 'localtime'), COUNT(*) FROM paid_users WHERE paid_at IS NOT NULL GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET paid = paid + excluded.paid
+        ''',
+        '''
+        INSERT INTO daily_stats (day, delivered)
+        SELECT date(updated_at, 'localtime'), COUNT(*) FROM broadcast_deliveries
+        WHERE status = 'sent' AND updated_at IS NOT NULL GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET delivered = delivered + excluded.delivered
+        ''',
+        '''
+        INSERT INTO daily_stats (day, blocked)
+        SELECT date(marked_at, 'localtime'), COUNT(*) FROM unreachable_users WHERE marked_at IS NOT NULL GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET blocked = blocked + excluded.blocked
+        ''',
+    ],
+    # 9: индекс для постраничного (по user_id) чтения получателей слота
+    [
+        'DROP INDEX IF EXISTS idx_broadcast_deliveries_slot',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_pending
+        ON broadcast_deliveries (job_id, status, slot, user_id)
+        ''',
+    ],
+    # 10: отметка об отправке самого файла — повтор выдачи не шлёт методичку второй раз
+    [
+        'ALTER TABLE manual_deliveries ADD COLUMN document_sent_at TIMESTAMP',
+        "UPDATE manual_deliveries SET document_sent_at = delivered_at WHERE status = 'sent'",
+    ],
+]
 
+def get_schema_version():
+    """Текущая версия схемы базы"""
+    return get_connection().execute('PRAGMA user_version').fetchone()[0]
+
+def init_db():
+    """Инициализация базы данных: применяет недостающие миграции"""
+    version = get_schema_version()
+    for target in range(version + 1, len(MIGRATIONS) + 1):
+        with transaction() as cursor:
+            # DDL не открывает транзакцию автоматически — открываем явно,
+            # чтобы миграция применялась целиком или не применялась вовсе
+            cursor.execute('BEGIN')
+            for statement in MIGRATIONS[target - 1]:
+                cursor.execute(statement)
+            cursor.execute(f'PRAGMA user_version = {target}')
+        print(f"Схема базы обновлена до версии {target}")
+
+@timed_query
 def add_user(user_id, username, first_name, last_name):
     """Добавление пользователя в базу"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    if _write_queue is not None:
+        _write_queue.put('users', user_id, (username, first_name, last_name), replace=False)
+        user_cache.update(user_id, known=True)
+        return
 
-    cursor.execute('''
-    INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-    VALUES (?, ?, ?, ?)
-    ''', (user_id, username, first_name, last_name))
+    with transaction() as cursor:
+        cursor.execute('''
+        INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+        VALUES (?, ?, ?, ?)
+        ''', (user_id, username, first_name, last_name))
 
-    conn.commit()
-    conn.close()
+        # Пользователь снова написал боту — значит, он его не блокирует
+        cursor.execute('''
+        DELETE FROM unreachable_users WHERE user_id = ?
+        ''', (user_id,))
+    user_cache.update(user_id, known=True)
 
+@timed_query
 def mark_as_interested(user_id):
     """Пометить пользователя как заинтересованного"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    if _write_queue is not None:
+        _write_queue.put('users', user_id, (None, None, None), replace=False)
+        _write_queue.put('interested_users', user_id, True)
+        user_cache.update(user_id, known=True, interested=True)
+        return
 
-    # Сначала добавляем пользователя, если его еще нет
-    cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-    if not cursor.fetchone():
+    with transaction() as cursor:
+        # Сначала добавляем пользователя, если его еще нет
         cursor.execute('''
-        INSERT INTO users (user_id) VALUES (?)
+        INSERT OR IGNORE INTO users (user_id) VALUES (?)
         ''', (user_id,))
 
-    # Помечаем как заинтересованного
+        # Помечаем как заинтересованного
+        cursor.execute('''
+        INSERT OR IGNORE INTO interested_users (user_id)
+        VALUES (?)
+        ''', (user_id,))
+    user_cache.update(user_id, known=True, interested=True)
+
+@timed_query
+def _select_user_status(user_id):
+    """Статус пользователя по базе: (known, interested, paid)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+    SELECT
+        EXISTS (SELECT 1 FROM users WHERE user_id = ?),
+        EXISTS (SELECT 1 FROM interested_users WHERE user_id = ?),
+        EXISTS (SELECT 1 FROM paid_users WHERE user_id = ?)
+    ''', (user_id, user_id, user_id))
+
+    return cursor.fetchone()
+
+def get_user_status(user_id):
+    """
+    Статус пользователя (known, interested, paid) — из кэша или из базы.
+    В метрики запросов попадают только обращения к базе (_select_user_status).
+    """
+    status = user_cache.get(user_id)
+    if status is not None:
+        return status
+
+    generation = user_cache.generation
+    pending_before = _pending_status(user_id)
+    stored = _select_user_status(user_id)
+    # Учитываем изменения, ещё не записанные из очереди отложенной записи
+    pending_after = _pending_status(user_id)
+    status = UserStatus(*(
+        bool(value) or before or after
+        for value, before, after in zip(stored, pending_before, pending_after)
+    ))
+    user_cache.put(user_id, status, generation)
+    return status
+
+@timed_query
+def warm_user_cache():
+    """Загрузить в кэш статусы последних пользователей"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
     cursor.execute('''
-    INSERT OR IGNORE INTO interested_users (user_id)
-    VALUES (?)
-    ''', (user_id,))
+    SELECT u.user_id, 1, i.user_id IS NOT NULL, p.user_id IS NOT NULL
+    FROM users u
+    LEFT JOIN interested_users i ON u.user_id = i.user_id
+    LEFT JOIN paid_users p ON u.user_id = p.user_id
+    ORDER BY u.joined_at DESC
+    LIMIT ?
+    ''', (user_cache.max_size,))
 
-    conn.commit()
-    conn.close()
+    rows = cursor.fetchall()
+    # Самые свежие пользователи попадают в кэш последними и вытесняются позже всех
+    user_cache.warm(reversed(rows))
+    return len(rows)
 
 def is_interested(user_id):
     """Проверить, заинтересован ли пользователь"""
-    conn = sqlite3.connect(DB_NAME)
+    return get_user_status(user_id).interested
+
+@timed_query
+def add_payment(user_id, payment_id):
+    """
+    Зарегистрировать оплату и поставить выдачу методички в очередь.
+    Возвращает False, если этот ID платежа уже использован другим пользователем;
+    повторная оплата того же пользователя ничего не меняет.
+    """
+    # Оплата фиксируется сразу, вместе со всем, что накопилось до неё
+    flush_pending_writes()
+
+    try:
+        with transaction(immediate=True) as cursor:
+            cursor.execute('''
+            SELECT user_id FROM manual_deliveries WHERE payment_id = ?
+            ''', (payment_id,))
+            row = cursor.fetchone()
+            if row is not None and row[0] != user_id:
+                return False
+
+            cursor.execute('''
+            INSERT OR IGNORE INTO paid_users (user_id, payment_id)
+            VALUES (?, ?)
+            ''', (user_id, payment_id))
+            # Одна выдача на пользователя: повторная оплата её не дублирует.
+            # Занятый другим пользователем payment_id нарушает UNIQUE — транзакция откатывается
+            cursor.execute('''
+            INSERT INTO manual_deliveries (user_id, payment_id)
+            VALUES (?, ?)
+            ON CONFLICT (user_id) DO NOTHING
+            ''', (user_id, payment_id))
+    except sqlite3.IntegrityError:
+        # ID платежа уже использован другим пользователем
+        return False
+
+    user_cache.update(user_id, paid=True)
+    return True
+
+def is_paid(user_id):
+    """Проверить, оплатил ли пользователь"""
+    return get_user_status(user_id).paid
+
+# Списки пользователей для постраничного вывода: таблица -> столбец с датой
+_ROSTERS = {
+    'interested_users': 'interested_at',
+    'paid_users': 'paid_at',
+}
+
+@timed_query
+def get_roster_page(roster, after_id=None, before_id=None, limit=50):
+    """
+    Страница списка пользователей (interested_users или paid_users) по возрастанию user_id.
+    after_id — следующая страница после этого id, before_id — предыдущая страница до него.
+    Возвращает (строки [(user_id, username, first_name, last_name, дата), ...],
+    есть ли предыдущая страница, есть ли следующая).
+    """
+    date_column = _ROSTERS[roster]
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    if before_id is not None:
+        cursor.execute(f'''
+        SELECT u.user_id, u.username, u.first_name, u.last_name, r.{date_column}
+        FROM {roster} r
+        JOIN users u ON u.user_id = r.user_id
+        WHERE r.user_id < ?
+        ORDER BY r.user_id DESC
+        LIMIT ?
+        ''', (before_id, limit + 1))
+        rows = cursor.fetchall()
+        has_prev = len(rows) > limit
+        return rows[:limit][::-1], has_prev, True
+
+    cursor.execute(f'''
+    SELECT u.user_id, u.username, u.first_name, u.last_name, r.{date_column}
+    FROM {roster} r
+    JOIN users u ON u.user_id = r.user_id
+    WHERE r.user_id > ?
+    ORDER BY r.user_id
+    LIMIT ?
+    ''', (after_id if after_id is not None else -1, limit + 1))
+    rows = cursor.fetchall()
+    has_next = len(rows) > limit
+    return rows[:limit], after_id is not None, has_next
+
+# Наборы данных для выгрузки: имя -> (столбцы, запрос, столбец с датой для фильтра)
+EXPORTS = {
+    'users': (
+        ('user_id', 'username', 'first_name', 'last_name', 'interested_at'),
+        '''
+        SELECT u.user_id, u.username, u.first_name, u.last_name, i.interested_at
+        FROM interested_users i
+        JOIN users u ON u.user_id = i.user_id
+        ''',
+        'i.interested_at'
+    ),
+    'paid': (
+        ('user_id', 'username', 'first_name', 'last_name', 'paid_at', 'payment_id'),
+        '''
+        SELECT u.user_id, u.username, u.first_name, u.last_name, p.paid_at, p.payment_id
+        FROM paid_users p
+        JOIN users u ON u.user_id = p.user_id
+        ''',
+        'p.paid_at'
+    ),
+    'messages': (
+        ('id', 'sender_id', 'receiver_id', 'message', 'sent_at'),
+        '''
+        SELECT m.id, m.sender_id, m.receiver_id, m.message, m.sent_at
+        FROM messages m
+        ''',
+        'm.sent_at'
+    ),
+}
+
+def iter_export_rows(dataset, since=None, until=None, batch_size=1000):
+    """
+    Построчно отдаёт набор данных для выгрузки, не загружая его в память целиком.
+    since / until — строки 'ГГГГ-ММ-ДД' (until включительно).
+    """
+    columns, query, date_column = EXPORTS[dataset]
+    conditions = []
+    params = []
+    if since:
+        conditions.append(f"{date_column} >= ?")
+        params.append(since)
+    if until:
+        conditions.append(f"{date_column} < date(?, '+1 day')")
+        params.append(until)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY 1"
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+@timed_query
+def add_message(sender_id, receiver_id, message):
+    """Добавить сообщение в историю"""
+    with transaction() as cursor:
+        cursor.execute('''
+        INSERT INTO messages (sender_id, receiver_id, message)
+        VALUES (?, ?, ?)
+        ''', (sender_id, receiver_id, message))
+
+@timed_query
+def add_user_message(user_id, message):
+    """
+    Сохранить обращение пользователя к администраторам.
+    Возвращает True, если у пользователя до этого не было открытых обращений.
+    """
+    with transaction(immediate=True) as cursor:
+        cursor.execute('''
+        SELECT EXISTS (
+            SELECT 1 FROM messages
+            WHERE sender_id = ? AND status IN ('new', 'unread')
+        )
+        ''', (user_id,))
+        had_open = cursor.fetchone()[0]
+
+        # receiver_id = 0: сообщение адресовано всем администраторам
+        cursor.execute('''
+        INSERT INTO messages (sender_id, receiver_id, message, status)
+        VALUES (?, 0, ?, 'new')
+        ''', (user_id, message))
+    return not had_open
+
+@timed_query
+def add_reply(admin_id, user_id, message):
+    """Сохранить ответ администратора и закрыть открытые обращения пользователя"""
+    with transaction() as cursor:
+        cursor.execute('''
+        INSERT INTO messages (sender_id, receiver_id, message)
+        VALUES (?, ?, ?)
+        ''', (admin_id, user_id, message))
+
+        cursor.execute('''
+        UPDATE messages
+        SET status = 'answered', assigned_to = ?
+        WHERE sender_id = ? AND status IN ('new', 'unread')
+        ''', (admin_id, user_id))
+
+@timed_query
+def assign_support_thread(user_id, admin_id):
+    """Закрепить открытые обращения пользователя за администратором"""
+    with transaction() as cursor:
+        cursor.execute('''
+        UPDATE messages
+        SET assigned_to = ?
+        WHERE sender_id = ? AND status IN ('new', 'unread')
+        ''', (admin_id, user_id))
+
+@timed_query
+def get_inbox_page(after_id=None, limit=10):
+    """
+    Страница открытых обращений, начиная с самых давних.
+    after_id — курсор: id первого сообщения последнего обращения предыдущей страницы.
+    Возвращает (обращения [(user_id, username, first_name, непрочитанных,
+    id первого сообщения, последнее сообщение, за кем закреплено), ...],
+    курсор следующей страницы или None).
+    """
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
-    SELECT 1 FROM interested_users WHERE user_id = ?
-    ''', (user_id,))
+    SELECT t.sender_id, u.username, u.first_name, t.unread, t.first_id, m.message, t.assigned_to
+    FROM (
+        SELECT sender_id, COUNT(*) AS unread, MIN(id) AS first_id, MAX(id) AS last_id,
+               MAX(assigned_to) AS assigned_to
+        FROM messages
+        WHERE status IN ('new', 'unread')
+        GROUP BY sender_id
+        HAVING MIN(id) > ?
+        ORDER BY first_id
+        LIMIT ?
+    ) t
+    JOIN messages m ON m.id = t.last_id
+    LEFT JOIN users u ON u.user_id = t.sender_id
+    ORDER BY t.first_id
+    ''', (after_id if after_id is not None else -1, limit + 1))
 
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    threads = cursor.fetchall()
+    if len(threads) > limit:
+        threads = threads[:limit]
+        return threads, threads[-1][4]
+    return threads, None
 
-def add_payment(user_id, payment_id):
-    """Добавить информацию об оплате"""
-    conn = sqlite3.connect(DB_NAME)
+@timed_query
+def count_open_support_threads():
+    """Число пользователей с открытыми обращениями"""
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
-    INSERT OR REPLACE INTO paid_users (user_id, payment_id)
-    VALUES (?, ?)
-    ''', (user_id, payment_id))
+    SELECT COUNT(DISTINCT sender_id) FROM messages
+    WHERE status IN ('new', 'unread')
+    ''')
 
-    conn.commit()
-    conn.close()
+    return cursor.fetchone()[0]
 
-def is_paid(user_id):
-    """Проверить, оплатил ли пользователь"""
-    conn = sqlite3.connect(DB_NAME)
+@timed_query
+def take_new_support_messages():
+    """Забрать обращения, ещё не попавшие в сводку: [(id, sender_id, message), ...]"""
+    with transaction() as cursor:
+        cursor.execute('''
+        UPDATE messages
+        SET status = 'unread'
+        WHERE status = 'new'
+        RETURNING id, sender_id, message
+        ''')
+        return sorted(cursor.fetchall())
+
+def _fts_query(text):
+    """
+    Запрос пользователя -> безопасный запрос FTS5: слова ищутся по префиксу,
+    операторы и спецсимволы FTS5 не интерпретируются. None, если слов нет.
+    """
+    words = re.findall(r'\w+', text.lower())
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+@timed_query
+def search_users(text, limit=5):
+    """Пользователи, чьё имя или username совпадает с запросом: [(user_id, username, first_name, last_name), ...]"""
+    query = _fts_query(text)
+    if query is None:
+        return []
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
-    SELECT 1 FROM paid_users WHERE user_id = ?
-    ''', (user_id,))
+    SELECT u.user_id, u.username, u.first_name, u.last_name
+    FROM users_fts f
+    JOIN users u ON u.user_id = f.rowid
+    WHERE users_fts MATCH ?
+    ORDER BY f.rank
+    LIMIT ?
+    ''', (query, limit))
+
+    return cursor.fetchall()
+
+@timed_query
+def search_messages(text, after=None, limit=10):
+    """
+    Сообщения, подходящие под запрос, от самых релевантных.
+    after — курсор (rank, id) последнего сообщения предыдущей страницы.
+    Возвращает (сообщения [(id, sender_id, receiver_id, sent_at, фрагмент, rank), ...],
+    курсор следующей страницы или None).
+    """
+    query = _fts_query(text)
+    if query is None:
+        return [], None
+    rank, last_id = after if after is not None else (float('-inf'), 0)
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+    SELECT m.id, m.sender_id, m.receiver_id, m.sent_at,
+           snippet(messages_fts, 0, '[', ']', '…', 12), f.rank
+    FROM messages_fts f
+    JOIN messages m ON m.id = f.rowid
+    WHERE messages_fts MATCH ? AND (f.rank, f.rowid) > (?, ?)
+    ORDER BY f.rank, f.rowid
+    LIMIT ?
+    ''', (query, rank, last_id, limit + 1))
+
+    hits = cursor.fetchall()
+    if len(hits) > limit:
+        hits = hits[:limit]
+        return hits, (hits[-1][5], hits[-1][0])
+    return hits, None
+
+@timed_query
+def get_message_history_page(user_id, before_id=None, limit=20):
+    """
+    Страница истории сообщений пользователя, от новых к старым.
+    before_id — курсор: id самого старого сообщения предыдущей страницы.
+    Возвращает (сообщения [(id, sender_id, receiver_id, message, sent_at), ...],
+    курсор следующей страницы или None).
+    """
+    if before_id is None:
+        before_id = 2 ** 63 - 1
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    # Каждая ветка читает не больше limit + 1 строк по своему индексу
+    cursor.execute('''
+    SELECT id, sender_id, receiver_id, message, sent_at FROM (
+        SELECT * FROM (
+            SELECT id, sender_id, receiver_id, message, sent_at
+            FROM messages
+            WHERE sender_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        )
+        UNION
+        SELECT * FROM (
+            SELECT id, sender_id, receiver_id, message, sent_at
+            FROM messages
+            WHERE receiver_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        )
+    )
+    ORDER BY id DESC
+    LIMIT ?
+    ''', (user_id, before_id, limit + 1, user_id, before_id, limit + 1, limit + 1))
+
+    messages = cursor.fetchall()
+    if len(messages) > limit:
+        messages = messages[:limit]
+        return messages, messages[-1][0]
+    return messages, None
+
+@timed_query
+def get_media_file_id(path, content_hash):
+    """Получить сохранённый file_id для файла с заданным содержимым"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+    SELECT file_id FROM media_cache WHERE path = ? AND content_hash = ?
+    ''', (path, content_hash))
 
     result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    return result[0] if result else None
+
+@timed_query
+def save_media_file_id(path, content_hash, file_id):
+    """Сохранить file_id файла (старые версии этого файла удаляются)"""
+    with transaction() as cursor:
+        cursor.execute('''
+        DELETE FROM media_cache WHERE path = ? AND content_hash != ?
+        ''', (path, content_hash))
+        cursor.execute('''
+        INSERT OR REPLACE INTO media_cache (path, content_hash, file_id)
+        VALUES (?, ?, ?)
+        ''', (path, content_hash, file_id))
 
-def get_interested_users():
-    """Получить список заинтересованных пользователей"""
-    conn = sqlite3.connect(DB_NAME)
+@timed_query
+def delete_media_file_id(path):
+    """Удалить сохранённые file_id файла"""
+    with transaction() as cursor:
+        cursor.execute('''
+        DELETE FROM media_cache WHERE path = ?
+        ''', (path,))
+
+# Сегменты получателей рассылок: запросы, возвращающие user_id.
+# Недоступные пользователи (unreachable_users) исключаются из любого сегмента.
+SEGMENTS = {
+    'interested': '''
+        SELECT i.user_id FROM interested_users i
+    ''',
+    'interested_not_paid': '''
+        SELECT i.user_id FROM interested_users i
+        WHERE NOT EXISTS (SELECT 1 FROM paid_users p WHERE p.user_id = i.user_id)
+    ''',
+    'joined_not_interested': '''
+        SELECT u.user_id FROM users u
+        WHERE NOT EXISTS (SELECT 1 FROM interested_users i WHERE i.user_id = u.user_id)
+    ''',
+    'paid': '''
+        SELECT p.user_id FROM paid_users p
+    ''',
+    'all': '''
+        SELECT u.user_id FROM users u
+    ''',
+}
+
+@timed_query
+def create_broadcast_job(message, segment='interested', slots=1, window_seconds=0):
+    """
+    Создать рассылку и зафиксировать список получателей сегмента; возвращает id рассылки.
+    Получатели делятся на slots слотов по user_id, слоты рассылаются
+    равномерно в течение window_seconds секунд.
+    """
+    if segment not in SEGMENTS:
+        raise ValueError(f"Неизвестный сегмент: {segment}")
+    slots = max(1, slots)
+
+    with transaction() as cursor:
+        cursor.execute('''
+        INSERT INTO broadcast_jobs (message, segment, slots, window_seconds) VALUES (?, ?, ?, ?)
+        ''', (message, segment, slots, window_seconds))
+        job_id = cursor.lastrowid
+
+        # Id пользователей Telegram распределены равномерно — остаток от деления
+        # даёт слоты примерно одного размера
+        cursor.execute(f'''
+        INSERT INTO broadcast_deliveries (job_id, user_id, slot)
+        SELECT ?, s.user_id, s.user_id % ?
+        FROM ({SEGMENTS[segment]}) s
+        WHERE NOT EXISTS (SELECT 1 FROM unreachable_users x WHERE x.user_id = s.user_id)
+        ''', (job_id, slots))
+    return job_id
+
+@timed_query
+def get_broadcast_job(job_id):
+    """Рассылка: (message, created_at в секундах Unix, slots, window_seconds)"""
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
-    SELECT u.user_id, u.username, u.first_name, u.last_name, i.interested_at
-    FROM users u
-    JOIN interested_users i ON u.user_id = i.user_id
-    ''')
+    SELECT message, CAST(strftime('%s', created_at) AS INTEGER), slots, window_seconds
+    FROM broadcast_jobs
+    WHERE id = ?
+    ''', (job_id,))
 
-    users = cursor.fetchall()
-    conn.close()
-    return users
+    return cursor.fetchone()
 
-def get_paid_users():
-    """Получить список оплативших пользователей"""
-    conn = sqlite3.connect(DB_NAME)
+@timed_query
+def get_unfinished_broadcast_jobs():
+    """Получить незавершённые рассылки (id, message)"""
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
-    SELECT u.user_id, u.username, u.first_name, u.last_name, p.paid_at
-    FROM users u
-    JOIN paid_users p ON u.user_id = p.user_id
+    SELECT id, message FROM broadcast_jobs
+    WHERE status = 'running'
+    ORDER BY id
     ''')
 
-    users = cursor.fetchall()
-    conn.close()
-    return users
+    jobs = cursor.fetchall()
+    return jobs
 
-def add_message(sender_id, receiver_id, message):
-    """Добавить сообщение в историю"""
-    conn = sqlite3.connect(DB_NAME)
+@timed_query
+def get_pending_slots(job_id):
+    """Слоты рассылки, в которых остались недоставленные сообщения: [(slot, count), ...]"""
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
-    INSERT INTO messages (sender_id, receiver_id, message)
-    VALUES (?, ?, ?)
-    ''', (sender_id, receiver_id, message))
+    SELECT slot, COUNT(*) FROM broadcast_deliveries
+    WHERE job_id = ? AND status = 'pending'
+    GROUP BY slot
+    ORDER BY slot
+    ''', (job_id,))
 
-    conn.commit()
-    conn.close()
+    return cursor.fetchall()
 
-def get_message_history(user_id):
-    """Получить историю сообщений для пользователя"""
-    conn = sqlite3.connect(DB_NAME)
+@timed_query
+def _get_pending_deliveries_batch(job_id, slot, after_id, limit):
+    """Очередная пачка id получателей слота, которым рассылка ещё не доставлена"""
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
-    SELECT sender_id, receiver_id, message, sent_at
-    FROM messages
-    WHERE sender_id = ? OR receiver_id = ?
-    ORDER BY sent_at
-    ''', (user_id, user_id))
+    SELECT user_id FROM broadcast_deliveries
+    WHERE job_id = ? AND status = 'pending' AND slot = ? AND user_id > ?
+    ORDER BY user_id
+    LIMIT ?
+    ''', (job_id, slot, after_id, limit))
 
-    messages = cursor.fetchall()
-    conn.close()
-    return messages
\ No newline at end of file
+    return [row[0] for row in cursor.fetchall()]
+
+def iter_pending_deliveries(job_id, slot=None, batch_size=BROADCAST_FETCH_BATCH):
+    """
+    Генератор id пользователей, которым рассылка ещё не доставлена (в одном слоте или во всех).
+    Читает пачками по batch_size с курсором по user_id: в памяти не больше одной пачки,
+    а каждый запрос короткий и не держит чтение базы на всё время рассылки.
+    """
+    if slot is None:
+        for pending_slot, _ in get_pending_slots(job_id):
+            yield from iter_pending_deliveries(job_id, pending_slot, batch_size)
+        return
+
+    after_id = -1
+    while True:
+        batch = _get_pending_deliveries_batch(job_id, slot, after_id, batch_size)
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        after_id = batch[-1]
+
+@timed_query
+def save_delivery_results(job_id, results):
+    """
+    Сохранить пачку результатов доставки: [(user_id, status, error), ...].
+    Получатели со статусом 'unreachable' исключаются из будущих рассылок.
+    """
+    with transaction() as cursor:
+        cursor.executemany('''
+        UPDATE broadcast_deliveries
+        SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE job_id = ? AND user_id = ?
+        ''', [(status, error, job_id, user_id) for user_id, status, error in results])
+        cursor.executemany('''
+        INSERT OR IGNORE INTO unreachable_users (user_id, reason)
+        VALUES (?, ?)
+        ''', [(user_id, error) for user_id, status, error in results if status == 'unreachable'])
+
+@timed_query
+def finish_broadcast_job(job_id):
+    """Пометить рассылку как завершённую"""
+    with transaction() as cursor:
+        cursor.execute('''
+        UPDATE broadcast_jobs
+        SET status = 'done', finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (job_id,))
+
+@timed_query
+def get_last_broadcast_time(segment=None):
+    """
+    Время последней рассылки (по местному времени) или None, если рассылок не было.
+    Для прерванной рассылки берётся время её создания.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+    SELECT datetime(MAX(COALESCE(finished_at, created_at)), 'localtime')
+    FROM broadcast_jobs
+    WHERE ? IS NULL OR segment = ?
+    ''', (segment, segment))
+
+    value = cursor.fetchone()[0]
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S') if value else None
+
+@timed_query
+def claim_manual_deliveries(limit):
+    """Забрать выдачи, время которых подошло: [(user_id, payment_id, attempts, document_sent), ...]"""
+    with transaction() as cursor:
+        cursor.execute('''
+        UPDATE manual_deliveries
+        SET status = 'sending'
+        WHERE user_id IN (
+            SELECT user_id FROM manual_deliveries
+            WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY next_attempt_at
+            LIMIT ?
+        )
+        RETURNING user_id, payment_id, attempts, document_sent_at IS NOT NULL
+        ''', (limit,))
+        return cursor.fetchall()
+
+@timed_query
+def mark_manual_document_sent(user_id):
+    """Отметить, что файл методички отправлен (осталось приглашение в беседу)"""
+    with transaction() as cursor:
+        cursor.execute('''
+        UPDATE manual_deliveries SET document_sent_at = CURRENT_TIMESTAMP
+        WHERE user_id = ?
+        ''', (user_id,))
+
+@timed_query
+def finish_manual_delivery(user_id):
+    """Отметить методичку выданной"""
+    with transaction() as cursor:
+        cursor.execute('''
+        UPDATE manual_deliveries
+        SET status = 'sent', error = NULL, delivered_at = CURRENT_TIMESTAMP
+        WHERE user_id = ?
+        ''', (user_id,))
+
+@timed_query
+def fail_manual_delivery(user_id, error, retry_in=None):
+    """Записать неудачную попытку: повтор через retry_in секунд или окончательная ошибка (None)"""
+    with transaction() as cursor:
+        cursor.execute('''
+        UPDATE manual_deliveries
+        SET status = CASE WHEN ? IS NULL THEN 'failed' ELSE 'pending' END,
+            attempts = attempts + 1,
+            error = ?,
+            next_attempt_at = datetime('now', ?)
+        WHERE user_id = ?
+        ''', (retry_in, error, f"+{retry_in or 0} seconds", user_id))
+
+@timed_query
+def reset_manual_deliveries():
+    """Вернуть в очередь выдачи, прерванные перезапуском процесса"""
+    with transaction() as cursor:
+        cursor.execute('''
+        UPDATE manual_deliveries SET status = 'pending' WHERE status = 'sending'
+        ''')
+        return cursor.rowcount
+
+@timed_query
+def get_daily_stats(days):
+    """Строки воронки за последние days дней (включая сегодня): [(day, joined, interested, paid, delivered, blocked), ...]"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+    SELECT day, joined, interested, paid, delivered, blocked
+    FROM daily_stats
+    WHERE day > date('now', 'localtime', ?)
+    ORDER BY day
+    ''', (f"-{days} days",))
+
+    return cursor.fetchall()
+
+@timed_query
+def get_stats_totals():
+    """Итоги воронки за всё время (по строкам daily_stats — по одной на день)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+    SELECT COALESCE(SUM(joined), 0), COALESCE(SUM(interested), 0), COALESCE(SUM(paid), 0),
+           COALESCE(SUM(delivered), 0), COALESCE(SUM(blocked), 0)
+    FROM daily_stats
+    ''')
+
+    return cursor.fetchone()
@@ -0,0 +1,59 @@
+# exporter.py
+import csv
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime
+from database import EXPORTS, iter_export_rows
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def _write_csv(f, columns, rows):
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    writer.writerows(rows)
+
+
+def _write_jsonl(f, columns, rows):
+    for row in rows:
+        f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        f.write('\n')
+
+
+def export_dataset(dataset, fmt='csv', since=None, until=None):
+    """
+    Выгружает набор данных (users, paid, messages) во временный файл .csv.gz / .jsonl.gz.
+    Строки идут из SQLite прямо в gzip, без накопления в памяти.
+    Возвращает (путь к файлу, имя файла для отправки); файл удаляет вызывающий.
+    """
+    if dataset not in EXPORTS:
+        raise ValueError(f"Неизвестный набор данных: {dataset}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+
+    # Проверяем даты заранее, чтобы не выгружать файл с неверным фильтром
+    for value in (since, until):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"Неверная дата: {value}. Формат: ГГГГ-ММ-ДД")
+
+    columns = EXPORTS[dataset][0]
+    rows = iter_export_rows(dataset, since, until)
+    write = _write_csv if fmt == 'csv' else _write_jsonl
+
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}.gz')
+    os.close(fd)
+    try:
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+            write(f, columns, rows)
+    except Exception:
+        os.remove(path)
+        raise
+
+    period = '_'.join(value for value in (since, until) if value)
+    filename = f"{dataset}{'_' + period if period else ''}_{datetime.now():%Y%m%d_%H%M}.{fmt}.gz"
+    return path, filename
@@ -0,0 +1,122 @@
+# flood_control.py
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    ADMIN_IDS,
+    FLOOD_RATE,
+    FLOOD_BURST,
+    FLOOD_DUPLICATE_WINDOW,
+    FLOOD_MAX_USERS,
+    FLOOD_IDLE_TTL
+)
+from metrics import FLOOD_DROPPED, FLOOD_TRACKED_USERS
+
+# Причины, по которым сообщение не передаётся обработчику
+DUPLICATE = 'duplicate'        # то же сообщение только что уже обработано
+THROTTLED = 'throttled'        # первое сообщение сверх лимита — можно предупредить пользователя
+RATE_LIMITED = 'rate_limited'  # последующие сообщения сверх лимита — отбрасываются молча
+
+_DROPPED = {reason: FLOOD_DROPPED.labels(reason) for reason in (DUPLICATE, THROTTLED, RATE_LIMITED)}
+
+
+class _UserState:
+    __slots__ = ('tokens', 'updated', 'last_text', 'last_text_at', 'warned')
+
+    def __init__(self, capacity, now):
+        self.tokens = capacity
+        self.updated = now
+        self.last_text = None
+        self.last_text_at = 0.0
+        self.warned = False
+
+
+class FloodControl:
+    """
+    Ограничение частоты сообщений от одного пользователя: token bucket
+    на пользователя и отбрасывание одинаковых сообщений, пришедших подряд.
+    Состояние хранится в LRU-таблице ограниченного размера; записи
+    пользователей, молчащих дольше idle_ttl секунд, удаляются.
+    """
+
+    def __init__(self, rate=FLOOD_RATE, burst=FLOOD_BURST, duplicate_window=FLOOD_DUPLICATE_WINDOW,
+                 max_users=FLOOD_MAX_USERS, idle_ttl=FLOOD_IDLE_TTL, exempt=ADMIN_IDS):
+        self.rate = rate
+        self.burst = burst
+        self.duplicate_window = duplicate_window
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.exempt = set(exempt)
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.dropped = 0
+        self.evictions = 0
+
+    def _expire_locked(self, now):
+        # Самые давно активные пользователи — в начале таблицы
+        while self._users:
+            user_id, state = next(iter(self._users.items()))
+            if now - state.updated < self.idle_ttl and len(self._users) <= self.max_users:
+                break
+            self._users.popitem(last=False)
+            self.evictions += 1
+
+    def check(self, user_id, text):
+        """
+        None, если сообщение можно обработать, иначе причина отказа
+        (DUPLICATE, THROTTLED или RATE_LIMITED)
+        """
+        if user_id in self.exempt:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                state = self._users[user_id] = _UserState(self.burst, now)
+            else:
+                self._users.move_to_end(user_id)
+                state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+                state.updated = now
+            self._expire_locked(now)
+
+            if text == state.last_text and now - state.last_text_at < self.duplicate_window:
+                reason = DUPLICATE
+            elif state.tokens < 1:
+                reason = RATE_LIMITED if state.warned else THROTTLED
+                state.warned = True
+            else:
+                state.tokens -= 1
+                state.warned = False
+                state.last_text = text
+                state.last_text_at = now
+                reason = None
+
+            if reason is None:
+                self.allowed += 1
+            else:
+                self.dropped += 1
+            tracked = len(self._users)
+
+        FLOOD_TRACKED_USERS.set(tracked)
+        if reason is not None:
+            _DROPPED[reason].inc()
+        return reason
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self):
+        """Счётчики защиты от флуда"""
+        with self._lock:
+            total = self.allowed + self.dropped
+            return {
+                'tracked_users': len(self._users),
+                'max_users': self.max_users,
+                'allowed': self.allowed,
+                'dropped': self.dropped,
+                'evictions': self.evictions,
+                'drop_rate': self.dropped / total if total else 0.0
+            }
@@ -1,15 +1,60 @@
-from flask import Flask
+from flask import Flask, request, abort
 from threading import Thread
+import hmac
+import queue
+import telebot
+from metrics import render_metrics
+from config import WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE
 
 app = Flask('')
 
+# Очередь входящих обновлений Telegram (режим webhook)
+updates = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+
 @app.route('/')
 def home():
     return "Бот работает!"
 
+@app.route('/metrics')
+def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def webhook():
+    """Приём обновления от Telegram: кладём в очередь и сразу отвечаем 200"""
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(token, WEBHOOK_SECRET):
+        abort(403)
+
+    try:
+        updates.put_nowait(request.get_data(as_text=True))
+    except queue.Full:
+        # Очередь переполнена: Telegram повторит доставку позже
+        return "Очередь обновлений переполнена", 503, {'Retry-After': '1'}
+    return ''
+
+def process_updates(bot):
+    """Рабочий поток: разбирает обновления из очереди и передаёт их обработчикам"""
+    while True:
+        data = updates.get()
+        try:
+            update = telebot.types.Update.de_json(data)
+            bot.process_new_updates([update])
+        except Exception as e:
+            print(f"❌ Ошибка обработки обновления: {e}")
+
+def enable_webhook(bot):
+    """Подключает приём обновлений через webhook (вызывать до keep_alive)"""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("Для режима webhook задайте WEBHOOK_SECRET")
+    app.add_url_rule(WEBHOOK_PATH, 'webhook', webhook, methods=['POST'])
+    for _ in range(WEBHOOK_WORKERS):
+        Thread(target=process_updates, args=(bot,), daemon=True).start()
+
 def run():
     app.run(host='0.0.0.0', port=8080)
 
 def keep_alive():
     t = Thread(target=run)
-    t.start()
\ No newline at end of file
+    t.start()
+    return t
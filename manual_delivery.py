@@ -0,0 +1,157 @@
+# manual_delivery.py
+import queue
+import threading
+from config import (
+    ADMIN_IDS,
+    MANUAL_PATH,
+    MANUAL_DELIVERY_WORKERS,
+    MANUAL_DELIVERY_MAX_ATTEMPTS,
+    MANUAL_DELIVERY_BACKOFF,
+    MANUAL_DELIVERY_POLL_INTERVAL
+)
+from database import (
+    claim_manual_deliveries,
+    mark_manual_document_sent,
+    finish_manual_delivery,
+    fail_manual_delivery,
+    reset_manual_deliveries
+)
+from media_cache import send_cached_document
+
+
+def send_manual(bot, user_id):
+    """Отправить файл методички"""
+    send_cached_document(
+        bot,
+        user_id,
+        MANUAL_PATH,
+        caption="📘 <b>Ваша методичка по медицинской наукометрии!</b>\n\n"
+                "Спасибо за покупку! Если у вас возникнут вопросы, наши создатели всегда готовы помочь.",
+        parse_mode='HTML'
+    )
+
+
+def send_chat_invite(bot, user_id):
+    """Сообщить о добавлении в закрытую беседу"""
+    bot.send_message(
+        user_id,
+        "🎉 Вы также были добавлены в закрытую беседу с создателями методички.\n\n"
+        "Добро пожаловать в сообщество профессионалов!"
+    )
+
+
+class ManualDeliveryQueue:
+    """
+    Выдача методички оплатившим: очередь хранится в таблице manual_deliveries,
+    рабочие потоки отправляют файл и повторяют попытки с растущей задержкой.
+    Отправленный файл отмечается в базе до приглашения в беседу, поэтому при
+    ошибке приглашения повторяется только оно.
+    """
+
+    def __init__(self, workers=MANUAL_DELIVERY_WORKERS, max_attempts=MANUAL_DELIVERY_MAX_ATTEMPTS,
+                 backoff=MANUAL_DELIVERY_BACKOFF, poll_interval=MANUAL_DELIVERY_POLL_INTERVAL):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.bot = None
+        self._tasks = queue.Queue()
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self, bot):
+        """Запустить потоки выдачи (прерванные перезапуском выдачи повторяются)"""
+        if self._threads:
+            return
+        self.bot = bot
+        restored = reset_manual_deliveries()
+        if restored:
+            print(f"🔁 Возобновлено выдач методички: {restored}")
+
+        self._threads = [threading.Thread(target=self._dispatch, name='manual-dispatch', daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._worker, name=f'manual-delivery-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def notify(self):
+        """Сообщить, что в очереди появилась новая выдача"""
+        self._wakeup.set()
+
+    def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                # Забираем не больше, чем успеют взять рабочие потоки
+                for task in claim_manual_deliveries(self.workers):
+                    self._tasks.put(task)
+                self._tasks.join()
+            except Exception as e:
+                print(f"❌ Ошибка очереди выдачи методички: {e}")
+            self._wakeup.wait(self.poll_interval)
+
+    def _worker(self):
+        while True:
+            user_id, payment_id, attempts, document_sent = self._tasks.get()
+            try:
+                self._deliver(user_id, payment_id, attempts + 1, document_sent)
+            except Exception as e:
+                # Ошибка базы (например, database is locked) не должна останавливать поток;
+                # выдача останется в статусе 'sending' и вернётся в очередь при перезапуске
+                print(f"❌ Ошибка выдачи методички пользователю {user_id}: {e}")
+            finally:
+                self._tasks.task_done()
+
+    def _deliver(self, user_id, payment_id, attempt, document_sent):
+        if not document_sent:
+            try:
+                send_manual(self.bot, user_id)
+            except Exception as e:
+                self._retry_or_fail(user_id, payment_id, attempt, e)
+                return
+            # Ошибка записи здесь — не ошибка отправки: файл уже у пользователя
+            mark_manual_document_sent(user_id)
+
+        try:
+            send_chat_invite(self.bot, user_id)
+        except Exception as e:
+            self._retry_or_fail(user_id, payment_id, attempt, e)
+            return
+
+        finish_manual_delivery(user_id)
+        # Следующая выдача может уже ждать — не ждём таймера
+        self._wakeup.set()
+
+    def _retry_or_fail(self, user_id, payment_id, attempt, error):
+        if attempt < self.max_attempts:
+            retry_in = self.backoff * 2 ** (attempt - 1)
+            print(f"Повтор выдачи методички пользователю {user_id} через {retry_in} с "
+                  f"(попытка {attempt}): {error}")
+            fail_manual_delivery(user_id, str(error), retry_in)
+        else:
+            print(f"❌ Ошибка при отправке методички пользователю {user_id}: {error}")
+            fail_manual_delivery(user_id, str(error))
+            self._report_failure(user_id, payment_id, error)
+
+    def _report_failure(self, user_id, payment_id, error):
+        try:
+            self.bot.send_message(
+                user_id,
+                "❌ Произошла ошибка при отправке методички. Пожалуйста, свяжитесь с администратором."
+            )
+        except Exception:
+            pass
+        for admin_id in ADMIN_IDS:
+            try:
+                self.bot.send_message(
+                    admin_id,
+                    f"❗ Не удалось выдать методичку пользователю {user_id} "
+                    f"(платёж {payment_id}) после {self.max_attempts} попыток: {error}"
+                )
+            except Exception as e:
+                print(f"❌ Не удалось уведомить администратора {admin_id}: {e}")
+
+
+manual_delivery = ManualDeliveryQueue()
@@ -0,0 +1,99 @@
+# media_cache.py
+import hashlib
+import os
+import threading
+from telebot.apihelper import ApiTelegramException
+from database import get_media_file_id, save_media_file_id, delete_media_file_id
+
+# path -> (mtime_ns, size, sha256), чтобы не перечитывать файл на каждый запрос
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+# Отдельная блокировка на каждый файл: при наплыве запросов файл
+# загружается в Telegram один раз, остальные потоки ждут и берут file_id
+_upload_locks = {}
+_upload_locks_lock = threading.Lock()
+
+
+def _file_hash(path):
+    """Возвращает sha256 содержимого файла (пересчитывается только при изменении файла)"""
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _hashes_lock:
+        cached = _hashes.get(path)
+    if cached and cached[:2] == key:
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+
+    with _hashes_lock:
+        _hashes[path] = (key[0], key[1], content_hash)
+    return content_hash
+
+
+def _upload_lock(path):
+    with _upload_locks_lock:
+        return _upload_locks.setdefault(path, threading.Lock())
+
+
+def _extract_file_id(sent, kind):
+    """Достаёт file_id из отправленного сообщения (Telegram может сменить тип медиа)"""
+    for attr in (kind, 'video', 'document', 'animation'):
+        media = getattr(sent, attr, None)
+        if media is not None:
+            return media.file_id
+    return None
+
+
+def _send_by_file_id(send, chat_id, path, content_hash, **kwargs):
+    """Отправка по сохранённому file_id; None, если отправить по нему не удалось"""
+    file_id = get_media_file_id(path, content_hash)
+    if not file_id:
+        return None
+
+    try:
+        return send(chat_id, file_id, **kwargs)
+    except ApiTelegramException as e:
+        if e.error_code != 400:
+            raise
+        # Telegram не принял file_id — забываем его и загружаем файл заново
+        print(f"⚠️ file_id для {path} отклонён Telegram, файл будет загружен заново: {e}")
+        delete_media_file_id(path)
+        return None
+
+
+def _send_cached(send, kind, chat_id, path, **kwargs):
+    content_hash = _file_hash(path)
+
+    sent = _send_by_file_id(send, chat_id, path, content_hash, **kwargs)
+    if sent is not None:
+        return sent
+
+    with _upload_lock(path):
+        # Пока ждали блокировку, файл мог загрузить другой поток
+        sent = _send_by_file_id(send, chat_id, path, content_hash, **kwargs)
+        if sent is not None:
+            return sent
+
+        with open(path, 'rb') as f:
+            sent = send(chat_id, f, **kwargs)
+
+        file_id = _extract_file_id(sent, kind)
+        if file_id:
+            save_media_file_id(path, content_hash, file_id)
+        return sent
+
+
+def send_cached_video(bot, chat_id, path, **kwargs):
+    """Отправляет видео, загружая файл в Telegram только при первом запросе"""
+    return _send_cached(bot.send_video, 'video', chat_id, path, **kwargs)
+
+
+def send_cached_document(bot, chat_id, path, **kwargs):
+    """Отправляет документ, загружая файл в Telegram только при первом запросе"""
+    return _send_cached(bot.send_document, 'document', chat_id, path, **kwargs)
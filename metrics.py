@@ -0,0 +1,225 @@
+# metrics.py
+import bisect
+import functools
+import threading
+import time
+from telebot import apihelper
+
+# Все созданные метрики в порядке объявления (для /metrics)
+REGISTRY = []
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)) + '}'
+
+
+class _Metric:
+    """
+    Метрика с метками. Дочерняя метрика для набора значений меток создаётся
+    один раз и кэшируется: вызывающий код может держать её у себя и не
+    создавать объекты меток на каждый вызов.
+    """
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for values, child in list(self._children.items()):
+            lines.extend(child.render(self.name, _format_labels(self.labelnames, values), self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labels, labelnames, values):
+        return [f'{name}{labels} {self.value}']
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labels, labelnames, values):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            bucket_labels = _format_labels(labelnames + ('le',), values + (le,))
+            lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+        lines.append(f'{name}_sum{labels} {total}')
+        lines.append(f'{name}_count{labels} {count}')
+        return lines
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+
+def render_metrics():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# === Метрики бота ===
+
+HANDLER_REQUESTS = Counter('bot_handler_requests_total', 'Вызовы обработчиков сообщений', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Исключения в обработчиках сообщений', ['handler'])
+HANDLER_LATENCY = Histogram('bot_handler_duration_seconds', 'Время работы обработчиков сообщений', ['handler'])
+
+FLOOD_DROPPED = Counter('bot_flood_dropped_total', 'Сообщения, отброшенные защитой от флуда', ['reason'])
+FLOOD_TRACKED_USERS = Gauge('bot_flood_tracked_users', 'Пользователи в таблице защиты от флуда')
+
+DB_QUERIES = Counter('bot_db_queries_total', 'Запросы к базе данных', ['query'])
+DB_LATENCY = Histogram('bot_db_query_duration_seconds', 'Время запросов к базе данных', ['query'],
+                       buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
+
+TELEGRAM_REQUESTS = Counter('bot_telegram_requests_total', 'Запросы к Telegram Bot API', ['method', 'code'])
+TELEGRAM_LATENCY = Histogram('bot_telegram_request_duration_seconds', 'Время запросов к Telegram Bot API', ['method'])
+
+BROADCAST_MESSAGES = Counter('bot_broadcast_messages_total', 'Сообщения рассылок по результату', ['result'])
+BROADCAST_THROUGHPUT = Gauge('bot_broadcast_throughput', 'Скорость последней рассылки (сообщ./с)')
+BROADCAST_PENDING = Gauge('bot_broadcast_pending', 'Получатели текущей рассылки, ожидающие отправки')
+BROADCAST_RUNNING = Gauge('bot_broadcast_running', 'Идёт ли сейчас рассылка (0/1)')
+
+
+def timed_query(func):
+    """Декоратор функций database.py: число и время запросов"""
+    requests = DB_QUERIES.labels(func.__name__)
+    latency = DB_LATENCY.labels(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latency.observe(time.perf_counter() - started)
+            requests.inc()
+
+    return wrapper
+
+
+def _send_request(method, url, **kwargs):
+    """Отправка запроса к Bot API с замером времени и кода ответа"""
+    api_method = url.rsplit('/', 1)[-1]
+    started = time.perf_counter()
+    try:
+        result = apihelper._get_req_session().request(method, url, **kwargs)
+    except Exception:
+        TELEGRAM_REQUESTS.labels(api_method, 'network_error').inc()
+        raise
+    finally:
+        TELEGRAM_LATENCY.labels(api_method).observe(time.perf_counter() - started)
+    TELEGRAM_REQUESTS.labels(api_method, result.status_code).inc()
+    return result
+
+
+def install_telegram_metrics():
+    """Подключает замеры ко всем запросам telebot к Bot API"""
+    if apihelper.CUSTOM_REQUEST_SENDER is None:
+        apihelper.CUSTOM_REQUEST_SENDER = _send_request
@@ -0,0 +1,125 @@
+# profiler.py
+import linecache
+import os
+import queue
+import selectors
+import socket
+import ssl
+import sys
+import threading
+import time
+from collections import Counter
+from config import PROFILE_INTERVAL, PROFILE_TOP_N
+
+# Одновременно может идти только один замер
+_profile_lock = threading.Lock()
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# Модули, внутри которых поток блокируется: Event/Condition/Queue, select Flask,
+# чтение сокета при long polling
+_WAIT_FILES = {module.__file__ for module in (threading, queue, selectors, socket, ssl)}
+
+
+def _is_idle(frame):
+    """
+    Поток ждёт (блокировка, сокет, sleep) — такие выборки не считаем нагрузкой.
+    Сама функция ожидания написана на C, поэтому в стеке видна вызывающая её строка.
+    """
+    filename = frame.f_code.co_filename
+    if filename in _WAIT_FILES:
+        return True
+    return 'sleep(' in linecache.getline(filename, frame.f_lineno)
+
+
+class ProfileResult:
+    """Результат замера: выборки по функциям и свёрнутые стеки"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = 0
+        self.idle_samples = 0
+        self.wait_counts = Counter()
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.stacks = Counter()
+        self.threads = Counter()
+
+    def add(self, thread_name, frame):
+        self.samples += 1
+        if _is_idle(frame):
+            self.idle_samples += 1
+            self.wait_counts[_frame_key(frame)] += 1
+            return
+
+        stack = []
+        while frame is not None:
+            stack.append(_frame_key(frame))
+            frame = frame.f_back
+        stack.reverse()
+
+        self.self_counts[stack[-1]] += 1
+        self.total_counts.update(set(stack))
+        self.stacks[';'.join([thread_name] + stack)] += 1
+        self.threads[thread_name] += 1
+
+    def report(self, top_n=PROFILE_TOP_N):
+        """Текстовая сводка: самые горячие функции"""
+        busy = self.samples - self.idle_samples
+        lines = [
+            f"🔥 Профиль за {self.seconds} с",
+            f"Выборок: {self.samples}, из них ожидание: {self.idle_samples}"
+        ]
+        if self.idle_samples:
+            lines += ["", "Ожидание:"]
+            for key, count in self.wait_counts.most_common(top_n):
+                lines.append(f"  {count / self.idle_samples:6.1%}  {key}")
+        if not busy:
+            return "\n".join(lines + ["", "Все потоки простаивали."])
+
+        lines += ["", "Потоки:"]
+        for name, count in self.threads.most_common(top_n):
+            lines.append(f"  {count / busy:6.1%}  {name}")
+
+        lines += ["", "Собственное время:"]
+        for key, count in self.self_counts.most_common(top_n):
+            lines.append(f"  {count / busy:6.1%}  {key}")
+
+        lines += ["", "Включая вызовы:"]
+        for key, count in self.total_counts.most_common(top_n):
+            lines.append(f"  {count / busy:6.1%}  {key}")
+        return "\n".join(lines)
+
+    def write_stacks(self, path):
+        """Свёрнутые стеки (формат flamegraph.pl / speedscope)"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def profile(seconds, interval=PROFILE_INTERVAL):
+    """
+    Сэмплирующий профилировщик: seconds секунд снимает стеки всех потоков
+    (polling, планировщик, Flask) раз в interval секунд.
+    Возвращает ProfileResult или None, если уже идёт другой замер.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+
+    try:
+        result = ProfileResult(seconds)
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    result.add(names.get(thread_id, str(thread_id)), frame)
+            time.sleep(interval)
+        return result
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,215 @@
+# recorder.py
+import atexit
+import glob
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from datetime import datetime
+from config import (
+    ADMIN_IDS,
+    RECORD_DIR,
+    RECORD_SALT,
+    RECORD_SALT_FILE,
+    RECORD_MAX_BYTES,
+    RECORD_BACKUP_COUNT
+)
+
+# Поля с персональными данными, которые не попадают в запись
+_PERSONAL_FIELDS = ('username', 'last_name', 'phone_number', 'title', 'bio', 'vcard')
+# Поля с идентификаторами пользователей и чатов
+_ID_PARENTS = ('from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat')
+# Поля сообщений бота: в тексте и кнопках списков — настоящие id пользователей
+_BOT_MESSAGE_FIELDS = ('text', 'entities', 'reply_markup')
+
+# id пользователя в командах администратора: /history 123, /reply 123 ..., быстрый ответ «123 текст»
+_TEXT_USER_ID = re.compile(r'^(/(?:history|reply)(?:@\w+)?\s+|)(\d+)(?=\s|$)')
+# id пользователя в кнопках листания: users:next:123, paid:prev:123
+_CALLBACK_ROSTER = re.compile(r'^((?:users|paid):(?:prev|next):)(\d+)$')
+_CALLBACK_HISTORY = re.compile(r'^history:(\d+):\d*$')
+
+# Ключ для псевдонимов (читается при первом обращении)
+_salt = None
+
+
+def load_salt():
+    """
+    Ключ для псевдонимов: RECORD_SALT, иначе сохранённый в RECORD_SALT_FILE
+    (создаётся при первом запуске), чтобы псевдонимы не менялись между перезапусками
+    """
+    global _salt
+    if _salt is not None:
+        return _salt
+    if RECORD_SALT:
+        _salt = RECORD_SALT
+        return _salt
+    try:
+        with open(RECORD_SALT_FILE, encoding='utf-8') as f:
+            _salt = f.read().strip()
+    except FileNotFoundError:
+        _salt = secrets.token_hex(16)
+        os.makedirs(os.path.dirname(RECORD_SALT_FILE), exist_ok=True)
+        with open(RECORD_SALT_FILE, 'w', encoding='utf-8') as f:
+            f.write(_salt)
+    return _salt
+
+
+def anonymize_id(value, salt=None):
+    """Стабильный псевдоним для id (администраторы остаются как есть, чтобы их команды воспроизводились)"""
+    if value in ADMIN_IDS:
+        return value
+    digest = hmac.new((salt or load_salt()).encode(), str(value).encode(), hashlib.sha256).digest()
+    # Положительное 47-битное число: похоже на настоящие id и помещается в INTEGER SQLite
+    return int.from_bytes(digest[:6], 'big') >> 1
+
+
+def anonymize_text(text):
+    """Текст с псевдонимом вместо id пользователя в командах администратора"""
+    return _TEXT_USER_ID.sub(lambda m: f"{m.group(1)}{anonymize_id(int(m.group(2)))}", text)
+
+
+def anonymize_callback_data(data):
+    """
+    callback_data с псевдонимами вместо id пользователей. Курсоры по id сообщений
+    (inbox, history, search) в воспроизводимой базе не существуют — листание
+    начинается с первой страницы.
+    """
+    match = _CALLBACK_ROSTER.match(data)
+    if match:
+        return f"{match.group(1)}{anonymize_id(int(match.group(2)))}"
+    match = _CALLBACK_HISTORY.match(data)
+    if match:
+        return f"history:{anonymize_id(int(match.group(1)))}:"
+    if data.startswith(('inbox:', 'search:')):
+        return data.split(':', 1)[0] + ':'
+    return data
+
+
+def anonymize(data, parent=None):
+    """Копия обновления без персональных данных и с псевдонимами вместо id"""
+    if isinstance(data, list):
+        return [anonymize(item, parent) for item in data]
+    if not isinstance(data, dict):
+        return data
+
+    # Сообщения самого бота (например, под кнопкой callback-запроса) — без текста
+    from_bot = isinstance(data.get('from'), dict) and data['from'].get('is_bot')
+
+    result = {}
+    for key, value in data.items():
+        if key in _PERSONAL_FIELDS or (from_bot and key in _BOT_MESSAGE_FIELDS):
+            continue
+        if key == 'first_name':
+            # Обязательное поле User в Bot API — заменяем, а не удаляем
+            result[key] = 'Пользователь'
+            continue
+        if key == 'id' and parent in _ID_PARENTS and isinstance(value, int):
+            result[key] = anonymize_id(value)
+        elif key == 'user_id' and parent == 'contact' and isinstance(value, int):
+            result[key] = anonymize_id(value)
+        elif key == 'text' and isinstance(value, str):
+            result[key] = anonymize_text(value)
+        elif key == 'data' and parent == 'callback_query' and isinstance(value, str):
+            result[key] = anonymize_callback_data(value)
+        else:
+            result[key] = anonymize(value, key)
+    return result
+
+
+def update_to_dict(update):
+    """Исходный JSON обновления telebot (сообщения и callback-запросы)"""
+    data = {'update_id': update.update_id}
+    for field in ('message', 'edited_message', 'callback_query'):
+        value = getattr(update, field, None)
+        if value is not None and getattr(value, 'json', None) is not None:
+            data[field] = value.json
+    return data
+
+
+class UpdateRecorder:
+    """
+    Пишет входящие обновления в сжатый JSONL с ротацией по размеру:
+    {"t": время получения, "update": обезличенное обновление} на строку.
+    """
+
+    def __init__(self, directory=RECORD_DIR, max_bytes=RECORD_MAX_BYTES, backup_count=RECORD_BACKUP_COUNT):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = None
+        self._written = 0
+        self._lines_since_flush = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        path = os.path.join(self.directory, f"updates-{datetime.now():%Y%m%d-%H%M%S-%f}.jsonl.gz")
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._written = 0
+        self._remove_old()
+
+    def _remove_old(self):
+        files = sorted(glob.glob(os.path.join(self.directory, 'updates-*.jsonl.gz')))
+        for path in files[:-(self.backup_count + 1)]:
+            os.remove(path)
+
+    def record(self, updates):
+        received_at = time.time()
+        lines = [
+            json.dumps({'t': received_at, 'update': anonymize(update_to_dict(update))}, ensure_ascii=False)
+            for update in updates
+        ]
+        with self._lock:
+            if self._file is None or self._written >= self.max_bytes:
+                self._close_locked()
+                self._open()
+            for line in lines:
+                self._file.write(line + '\n')
+                self._written += len(line) + 1
+            self._lines_since_flush += len(lines)
+            # Периодически сбрасываем буфер, чтобы при падении терялось немного
+            if self._lines_since_flush >= 100:
+                self._file.flush()
+                self._lines_since_flush = 0
+
+    def _close_locked(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close_locked()
+
+    def attach(self, bot):
+        """Записывать все обновления бота (и polling, и webhook) перед обработкой"""
+        process_new_updates = bot.process_new_updates
+
+        def recording_process_new_updates(updates):
+            try:
+                self.record(updates)
+            except Exception as e:
+                print(f"❌ Не удалось записать обновления: {e}")
+            return process_new_updates(updates)
+
+        bot.process_new_updates = recording_process_new_updates
+        atexit.register(self.close)
+        return self
+
+
+def read_records(paths):
+    """Читает записи из файлов (в порядке имён), возвращает (t, update)"""
+    for path in sorted(paths):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    record = json.loads(line)
+                    yield record['t'], record['update']
+            except (EOFError, ValueError):
+                # Файл оборван при падении процесса — читаем, что успело записаться
+                continue
@@ -0,0 +1,158 @@
+# router.py
+import functools
+import time
+from config import ROUTER_DEBUG, SLOW_HANDLER_THRESHOLD
+from metrics import HANDLER_REQUESTS, HANDLER_ERRORS, HANDLER_LATENCY
+from flood_control import FloodControl, THROTTLED
+
+
+class Router:
+    """
+    Маршрутизация текстовых сообщений за O(1): команды и тексты кнопок
+    ищутся в словарях, и только если совпадения нет — проверяется
+    небольшой упорядоченный список шаблонов (предикатов).
+
+    Для бота регистрируется один обработчик telebot вместо цепочки
+    func=lambda-фильтров, которые telebot проверял по очереди.
+    """
+
+    def __init__(self, debug=ROUTER_DEBUG, flood_control=None, on_throttled=None):
+        self.debug = debug
+        # Проверяется до маршрутизации: лишние сообщения не доходят до обработчиков и базы
+        self.flood_control = flood_control
+        self.on_throttled = on_throttled
+        self.commands = {}
+        self.texts = {}
+        self.patterns = []
+        # Обработчик сообщений, для которых не нашлось маршрута
+        self.fallback_handler = None
+        # Метрики каждого обработчика создаются один раз при регистрации
+        self._metrics = {}
+
+    def _register_metrics(self, handler):
+        name = handler.__name__
+        self._metrics[handler] = (
+            HANDLER_REQUESTS.labels(name),
+            HANDLER_ERRORS.labels(name),
+            HANDLER_LATENCY.labels(name)
+        )
+
+    def command(self, *names):
+        """Декоратор: обработчик команд (/start, /buy ...)"""
+        def decorator(handler):
+            for name in names:
+                self.commands[name.lower()] = handler
+            self._register_metrics(handler)
+            return handler
+        return decorator
+
+    def text(self, *texts):
+        """Декоратор: обработчик точного текста (кнопки клавиатуры)"""
+        def decorator(handler):
+            for text in texts:
+                self.texts[text] = handler
+            self._register_metrics(handler)
+            return handler
+        return decorator
+
+    def pattern(self, predicate):
+        """Декоратор: обработчик по предикату; проверяются в порядке регистрации"""
+        def decorator(handler):
+            self.patterns.append((predicate, handler))
+            self._register_metrics(handler)
+            return handler
+        return decorator
+
+    def fallback(self, handler):
+        """Декоратор: обработчик всех сообщений, не попавших ни в один маршрут"""
+        self.fallback_handler = handler
+        self._register_metrics(handler)
+        return handler
+
+    @staticmethod
+    def extract_command(text):
+        """'/history@bot 123' -> 'history'; None, если это не команда"""
+        if not text.startswith('/'):
+            return None
+        return text.split(maxsplit=1)[0][1:].split('@', 1)[0].lower()
+
+    def resolve(self, message):
+        """Возвращает (обработчик или None, описание маршрута)"""
+        text = message.text or ''
+
+        command = self.extract_command(text)
+        if command is not None and command in self.commands:
+            return self.commands[command], f"command /{command}"
+
+        handler = self.texts.get(text)
+        if handler is not None:
+            return handler, "text"
+
+        for predicate, handler in self.patterns:
+            if predicate(message):
+                return handler, "pattern"
+
+        if self.fallback_handler is not None:
+            return self.fallback_handler, "fallback"
+        return None, "no route"
+
+    def dispatch(self, message):
+        if self.flood_control is not None:
+            reason = self.flood_control.check(message.from_user.id, message.text or '')
+            if reason is not None:
+                if self.debug:
+                    print(f"[router] {message.from_user.id}: {(message.text or '')[:50]!r} -> dropped ({reason})")
+                if reason == THROTTLED and self.on_throttled is not None:
+                    self.on_throttled(message)
+                return
+
+        handler, route = self.resolve(message)
+        if self.debug:
+            name = handler.__name__ if handler else '-'
+            print(f"[router] {message.from_user.id}: {(message.text or '')[:50]!r} -> {route} ({name})")
+        if handler is None:
+            return
+
+        self._call(handler, message, message.text or '')
+
+    def _call(self, handler, update, text):
+        """Вызов обработчика с метриками и журналом медленных обработчиков"""
+        requests, errors, latency = self._metrics[handler]
+        started = time.perf_counter()
+        try:
+            handler(update)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            latency.observe(elapsed)
+            requests.inc()
+            if elapsed > SLOW_HANDLER_THRESHOLD:
+                print(f"🐢 Медленный обработчик {handler.__name__}: {elapsed:.2f} с "
+                      f"(пользователь {update.from_user.id}, {text[:50]!r})")
+
+    def callback(self, handler):
+        """
+        Декоратор для обработчиков callback-запросов (их регистрирует telebot):
+        те же метрики и журнал медленных обработчиков, что и у сообщений
+        """
+        self._register_metrics(handler)
+
+        @functools.wraps(handler)
+        def wrapper(call):
+            self._call(handler, call, call.data or '')
+
+        return wrapper
+
+
+def get_router(bot):
+    """Маршрутизатор бота; при первом вызове регистрирует единый обработчик сообщений"""
+    router = getattr(bot, 'router', None)
+    if router is None:
+        def warn_throttled(message):
+            bot.send_message(message.chat.id, "⏳ Слишком много сообщений подряд. Подождите несколько секунд.")
+
+        router = bot.router = Router(flood_control=FloodControl(), on_throttled=warn_throttled)
+        bot.register_message_handler(router.dispatch, content_types=['text'])
+    return router
@@ -1,70 +1,111 @@
 # scheduler.py
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-import time
 from datetime import datetime, timedelta
 import telebot
-from config import NOTIFICATION_INTERVAL, SALE_START_DATE
-from database import get_interested_users
+from config import (
+    NOTIFICATION_INTERVAL,
+    NOTIFICATION_SEGMENT,
+    NOTIFICATION_MISFIRE_GRACE,
+    SUPPORT_DIGEST_MINUTES,
+    ADMIN_IDS
+)
+from broadcast import start_broadcast, resume_broadcasts
+from templates import render, sale_started
+from database import get_last_broadcast_time, take_new_support_messages, count_open_support_threads
+
+# Сколько пользователей перечислять в сводке обращений
+DIGEST_MAX_THREADS = 10
 
 def send_notifications(bot):
     """Отправка периодических уведомлений заинтересованным пользователям"""
-    now = datetime.now()
-
     # Проверяем, не началась ли продажа
-    if now >= SALE_START_DATE:
-        message = "🎉 Продажи методички по медицинской наукометрии уже начались!\n\n" \
-                  "Напишите /buy, чтобы получить ссылку на оплату и стать обладателем уникального материала!"
+    if sale_started():
+        message = render('notification_started')
     else:
-        time_left = get_time_until_sale()
-        message = f"⏳ Осталось всего {time_left} до старта продаж методички по медицинской наукометрии!\n\n" \
-                  "Этот материал поможет вам:\n" \
-                  "✅ Легко разобраться в медицинской наукометрии\n" \
-                  "✅ Проводить качественные исследования\n" \
-                  "✅ Публиковать статьи в топовых журналах\n\n" \
-                  "Напишите /promo, чтобы посмотреть промо-материалы и узнать больше!"
+        message = render('notification_countdown')
+
+    # Отправляем заинтересованным, кто ещё не оплатил
+    return start_broadcast(bot, message, NOTIFICATION_SEGMENT)
 
-    # Отправляем всем заинтересованным пользователям
-    interested_users = get_interested_users()
-    for user in interested_users:
-        user_id = user[0]
+def send_support_digest(bot):
+    """Одна сводка новых обращений пользователей каждому администратору за интервал"""
+    new_messages = take_new_support_messages()
+    if not new_messages:
+        return
+
+    threads = {}
+    for _, sender_id, text in new_messages:
+        count, first_text = threads.get(sender_id, (0, text))
+        threads[sender_id] = (count + 1, first_text)
+
+    lines = [f"📬 Новых сообщений: {len(new_messages)} от {len(threads)} пользователей", ""]
+    for sender_id, (count, first_text) in list(threads.items())[:DIGEST_MAX_THREADS]:
+        lines.append(f"👤 {sender_id} ({count}): «{first_text[:80]}»")
+    if len(threads) > DIGEST_MAX_THREADS:
+        lines.append(f"…и ещё {len(threads) - DIGEST_MAX_THREADS}")
+    lines += ["", f"Всего открытых обращений: {count_open_support_threads()}. Подробнее: /inbox"]
+    digest = "\n".join(lines)
+
+    for admin_id in ADMIN_IDS:
         try:
-            bot.send_message(user_id, message)
-            time.sleep(0.1)  # Задержка между сообщениями для избежания блокировки
+            bot.send_message(admin_id, digest)
         except Exception as e:
-            print(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
+            print(f"❌ Не удалось отправить сводку администратору {admin_id}: {e}")
 
-def get_time_until_sale():
-    """Возвращает оставшееся время до старта продаж в виде строки"""
+def get_next_notification_time():
+    """
+    Время следующего уведомления: через NOTIFICATION_INTERVAL часов после
+    последней рассылки из базы, а не после старта процесса.
+    """
     now = datetime.now()
-    if now >= SALE_START_DATE:
-        return "уже начались"
-
-    delta = SALE_START_DATE - now
-    days = delta.days
-    hours = delta.seconds // 3600
-    minutes = (delta.seconds % 3600) // 60
-
-    return f"{days} дней, {hours} часов, {minutes} минут"
+    last = get_last_broadcast_time(NOTIFICATION_SEGMENT)
+    if last is None:
+        return now
+    return max(now, last + timedelta(hours=NOTIFICATION_INTERVAL))
 
 def start_scheduler(bot):
     """Запуск планировщика уведомлений"""
-    scheduler = BackgroundScheduler()
+    scheduler = BackgroundScheduler(job_defaults={
+        # Пропущенные запуски сливаются в один и не копятся за время простоя
+        'coalesce': True,
+        'max_instances': 1,
+        'misfire_grace_time': NOTIFICATION_MISFIRE_GRACE
+    })
 
-    # Добавляем задачу для периодических уведомлений
+    # Досылаем рассылки, прерванные предыдущим перезапуском
     scheduler.add_job(
+        resume_broadcasts,
+        'date',
+        run_date=datetime.now(),
+        args=[bot],
+        id='resume_broadcasts',
+        replace_existing=True
+    )
+
+    # Периодические уведомления: расписание продолжается от последней рассылки,
+    # поэтому перезапуск бота не вызывает внеочередную рассылку. Первый запуск
+    # задаётся явно: IntervalTrigger с start_date в прошлом или «сейчас» назначил бы
+    # его только через целый интервал, и просроченное уведомление ждало бы ещё сутки
+    next_run = get_next_notification_time()
+    job = scheduler.add_job(
         send_notifications,
-        IntervalTrigger(hours=NOTIFICATION_INTERVAL),
-        args=[bot]
+        IntervalTrigger(hours=NOTIFICATION_INTERVAL, start_date=next_run),
+        next_run_time=next_run,
+        args=[bot],
+        id='notifications',
+        replace_existing=True
     )
+    print(f"⏰ Следующее уведомление: {job.next_run_time:%d.%m.%Y %H:%M}")
 
-    # Добавляем задачу для первого уведомления сразу после запуска
+    # Сводка обращений пользователей для администраторов
     scheduler.add_job(
-        send_notifications,
-        'date',
-        run_date=datetime.now(),
-        args=[bot]
+        send_support_digest,
+        IntervalTrigger(minutes=SUPPORT_DIGEST_MINUTES),
+        args=[bot],
+        id='support_digest',
+        replace_existing=True
     )
 
     scheduler.start()
-    return scheduler
\ No newline at end of file
+    return scheduler
@@ -0,0 +1,109 @@
+# templates.py
+from datetime import datetime
+import telebot
+from config import SALE_START_DATE, PAYMENT_URL
+
+# Текст вместо обратного отсчёта после старта продаж
+SALE_STARTED_TEXT = "продажи уже начались!"
+
+# Шаблоны сообщений с обратным отсчётом: {time_left} и {payment_url}
+TEMPLATES = {
+    'welcome': (
+        "👋 Добро пожаловать в сообщество медицинской наукометрии!\n\n"
+        "⏳ <b>Осталось до старта продаж:</b> *{time_left}*\n\n"
+        "📘 Уникальная методичка по медицинской наукометрии поможет вам:\n"
+        "✅ Легко разобраться в медицинской наукометрии\n"
+        "✅ Проводить качественные исследования\n"
+        "✅ Публиковать статьи в топовых журналах\n\n"
+        "Выберите, что хотите сделать:"
+    ),
+    'time_left': "⏳ <b>Осталось до старта продаж:</b> *{time_left}*",
+    'preorder': (
+        "🌟 <b>Забронируйте методичку уже сейчас!</b>\n\n"
+        "📅 Продажи начнутся через: *{time_left}*\n\n"
+        "✅ Получите методичку в первый день\n"
+        "🎁 Участие в закрытом обсуждении с авторами\n"
+        "🔒 Ваша копия будет зарезервирована\n\n"
+        "💳 <b>Ссылка для предоплаты:</b>\n"
+        "{payment_url}\n\n"
+        "После оплаты напишите сюда ваш <b>ID платежа</b> — и мы подтвердим бронь."
+    ),
+    'promo_thanks': (
+        "Спасибо за интерес! 🙌\n\n"
+        "⏳ До старта продаж осталось: *{time_left}*\n\n"
+        "Нажмите /start, чтобы увидеть меню."
+    ),
+    'buy_before_sale': (
+        "Продажи начнутся через: *{time_left}*\n\n"
+        "Но вы можете уже сейчас сделать <b>предзаказ</b> — нажмите /start и выберите «💳 Предзаказ»."
+    ),
+    'notification_countdown': (
+        "⏳ Осталось всего {time_left} до старта продаж методички по медицинской наукометрии!\n\n"
+        "Этот материал поможет вам:\n"
+        "✅ Легко разобраться в медицинской наукометрии\n"
+        "✅ Проводить качественные исследования\n"
+        "✅ Публиковать статьи в топовых журналах\n\n"
+        "Напишите /promo, чтобы посмотреть промо-материалы и узнать больше!"
+    ),
+    'notification_started': (
+        "🎉 Продажи методички по медицинской наукометрии уже начались!\n\n"
+        "Напишите /buy, чтобы получить ссылку на оплату и стать обладателем уникального материала!"
+    ),
+}
+
+# Кнопки главного меню
+MAIN_MENU_BUTTONS = (
+    "ℹ️ О методичке",
+    "🎬 Промо",
+    "⏳ Время до старта",
+    "💳 Предзаказ",
+    "📞 Связаться с админом"
+)
+
+
+def _build_main_menu():
+    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    keyboard.add(*MAIN_MENU_BUTTONS)
+    return keyboard.to_json()
+
+
+# Клавиатура сериализуется один раз: telebot передаёт строку reply_markup как есть
+MAIN_MENU = _build_main_menu()
+
+# Отрисованные сообщения: имя шаблона -> (минут до старта, текст)
+_rendered = {}
+
+
+def minutes_until_sale(now=None):
+    """Целых минут до старта продаж или None, если продажи уже начались"""
+    remaining = (SALE_START_DATE - (now or datetime.now())).total_seconds()
+    if remaining <= 0:
+        return None
+    return int(remaining // 60)
+
+
+def sale_started(now=None):
+    """Начались ли продажи"""
+    return minutes_until_sale(now) is None
+
+
+def format_time_left(minutes):
+    """Оставшееся время в виде строки: '3 дней, 4 часов, 5 минут'"""
+    if minutes is None:
+        return SALE_STARTED_TEXT
+    return f"{minutes // 1440} дней, {minutes % 1440 // 60} часов, {minutes % 60} минут"
+
+
+def render(name):
+    """
+    Текст сообщения по шаблону. Обратный отсчёт меняется раз в минуту,
+    поэтому текст отрисовывается один раз на каждую минуту до старта.
+    """
+    minutes = minutes_until_sale()
+    cached = _rendered.get(name)
+    if cached is not None and cached[0] == minutes:
+        return cached[1]
+
+    text = TEMPLATES[name].format(time_left=format_time_left(minutes), payment_url=PAYMENT_URL)
+    _rendered[name] = (minutes, text)
+    return text
@@ -0,0 +1,97 @@
+# user_cache.py
+import threading
+from collections import OrderedDict, namedtuple
+from config import USER_CACHE_SIZE
+
+# Статус пользователя: есть в users / в interested_users / в paid_users
+UserStatus = namedtuple('UserStatus', ['known', 'interested', 'paid'])
+
+
+class UserStatusCache:
+    """
+    Ограниченный LRU-кэш статусов пользователей.
+    Функции записи в database.py обновляют его сразу после commit.
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # Увеличивается при каждой записи; защищает от записи в кэш
+        # значения, прочитанного из базы до параллельного обновления
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Статус из кэша или None"""
+        with self._lock:
+            status = self._items.get(user_id)
+            if status is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(user_id)
+            self.hits += 1
+            return status
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def _put_locked(self, user_id, status):
+        self._items[user_id] = status
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, user_id, status, generation=None):
+        """
+        Сохранить статус, прочитанный из базы.
+        Если с момента чтения (generation) была запись — значение устарело и не сохраняется.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._put_locked(user_id, status)
+
+    def update(self, user_id, **changes):
+        """Обновить поля статуса после записи в базу"""
+        with self._lock:
+            self._generation += 1
+            status = self._items.get(user_id)
+            if status is not None:
+                self._put_locked(user_id, status._replace(**changes))
+
+    def bump_generation(self):
+        """Отметить запись в базу, не меняя содержимое кэша"""
+        with self._lock:
+            self._generation += 1
+
+    def warm(self, rows):
+        """Заполнить кэш строками (user_id, known, interested, paid)"""
+        with self._lock:
+            for user_id, known, interested, paid in rows:
+                self._put_locked(user_id, UserStatus(bool(known), bool(interested), bool(paid)))
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._items.clear()
+
+    def stats(self):
+        """Счётчики кэша"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+
+user_cache = UserStatusCache()
@@ -3,74 +3,39 @@ import os
 from config import (
     PROMO_VIDEO_PATH,
     PROMO_DOC_PATH,
-    MANUAL_PATH,
     PAYMENT_URL,
-    SALE_START_DATE,
     ADMIN_IDS
 )
-from database import add_user, mark_as_interested, is_paid, add_payment
-from datetime import datetime
-import telebot
+from database import add_user, mark_as_interested, is_paid, add_payment, add_user_message
+from media_cache import send_cached_video, send_cached_document
+from manual_delivery import manual_delivery
+from router import get_router
+from templates import render, sale_started, MAIN_MENU
 
 
 def register_user_handlers(bot):
     """
     Регистрирует все обработчики для пользователей
     """
-
-    def get_time_until_sale():
-        """Возвращает оставшееся время до старта продаж"""
-        now = datetime.now()
-        if now >= SALE_START_DATE:
-            return "продажи уже начались!"
-
-        delta = SALE_START_DATE - now
-        days = delta.days
-        hours = delta.seconds // 3600
-        minutes = (delta.seconds % 3600) // 60
-
-        return f"{days} дней, {hours} часов, {minutes} минут"
-
-    # === КЛАВИАТУРА ===
-    def get_main_menu():
-        """Создаёт клавиатуру с основными командами"""
-        keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-        keyboard.add(
-            "ℹ️ О методичке",
-            "🎬 Промо",
-            "⏳ Время до старта",
-            "💳 Предзаказ",
-            "📞 Связаться с админом"
-        )
-        return keyboard
+    router = get_router(bot)
 
     # === КОМАНДА /start ===
-    @bot.message_handler(commands=['start'])
+    @router.command('start')
     def send_welcome(message):
         """Приветственное сообщение с клавиатурой"""
         user = message.from_user
         add_user(user.id, user.username, user.first_name, user.last_name)
 
-        time_left = get_time_until_sale()
-
-        welcome_message = (f"👋 Добро пожаловать в сообщество медицинской наукометрии!\n\n"
-                          f"⏳ <b>Осталось до старта продаж:</b> *{time_left}*\n\n"
-                          f"📘 Уникальная методичка по медицинской наукометрии поможет вам:\n"
-                          f"✅ Легко разобраться в медицинской наукометрии\n"
-                          f"✅ Проводить качественные исследования\n"
-                          f"✅ Публиковать статьи в топовых журналах\n\n"
-                          f"Выберите, что хотите сделать:")
-
         bot.send_message(
             message.chat.id,
-            welcome_message,
+            render('welcome'),
             parse_mode='HTML',
-            reply_markup=get_main_menu()
+            reply_markup=MAIN_MENU
         )
 
 
     # === ОБРАБОТКА КНОПКИ "О методичке" ===
-    @bot.message_handler(func=lambda message: message.text == "ℹ️ О методичке")
+    @router.text("ℹ️ О методичке")
     def about_manual(message):
         bot.send_message(
             message.chat.id,
@@ -85,53 +50,34 @@ def register_user_handlers(bot):
         )
 
     # === ОБРАБОТКА КНОПКИ "Промо" ===
-    @bot.message_handler(func=lambda message: message.text == "🎬 Промо")
+    @router.text("🎬 Промо")
     def promo_button(message):
         user = message.from_user
         add_user(user.id, user.username, user.first_name, user.last_name)
         mark_as_interested(user.id)
 
         try:
-            with open(PROMO_VIDEO_PATH, 'rb') as video:
-                bot.send_video(message.chat.id, video, caption="🎥 Промо-видео о методичке")
+            send_cached_video(bot, message.chat.id, PROMO_VIDEO_PATH, caption="🎥 Промо-видео о методичке")
         except Exception as e:
             bot.send_message(message.chat.id, f"🎥 Видео временно недоступно: {e}")
 
         try:
-            with open(PROMO_DOC_PATH, 'rb') as doc:
-                bot.send_document(message.chat.id, doc, caption="📄 Промо-документ с подробной информацией")
+            send_cached_document(bot, message.chat.id, PROMO_DOC_PATH, caption="📄 Промо-документ с подробной информацией")
         except Exception as e:
             bot.send_message(message.chat.id, f"📄 Документ временно недоступен: {e}")
 
     # === ОБРАБОТКА КНОПКИ "Время до старта" ===
-    @bot.message_handler(func=lambda message: message.text == "⏳ Время до старта")
+    @router.text("⏳ Время до старта")
     def time_button(message):
-        time_left = get_time_until_sale()
-        bot.send_message(
-            message.chat.id,
-            f"⏳ <b>Осталось до старта продаж:</b> *{time_left}*",
-            parse_mode='HTML'
-        )
+        bot.send_message(message.chat.id, render('time_left'), parse_mode='HTML')
 
     # === ОБРАБОТКА КНОПКИ "Предзаказ" ===
-    @bot.message_handler(func=lambda message: message.text == "💳 Предзаказ")
+    @router.text("💳 Предзаказ")
     def preorder(message):
-        now = datetime.now()
-        time_left = get_time_until_sale()
-
-        preorder_message = (f"🌟 <b>Забронируйте методичку уже сейчас!</b>\n\n"
-                           f"📅 Продажи начнутся через: *{time_left}*\n\n"
-                           f"✅ Получите методичку в первый день\n"
-                           f"🎁 Участие в закрытом обсуждении с авторами\n"
-                           f"🔒 Ваша копия будет зарезервирована\n\n"
-                           f"💳 <b>Ссылка для предоплаты:</b>\n"
-                           f"{PAYMENT_URL}\n\n"
-                           f"После оплаты напишите сюда ваш <b>ID платежа</b> — и мы подтвердим бронь.")
-
-        bot.send_message(message.chat.id, preorder_message, parse_mode='HTML')
+        bot.send_message(message.chat.id, render('preorder'), parse_mode='HTML')
 
     # === ОБРАБОТКА КНОПКИ "Связаться с админом" ===
-    @bot.message_handler(func=lambda message: message.text == "📞 Связаться с админом")
+    @router.text("📞 Связаться с админом")
     def contact_admin(message):
         bot.send_message(
             message.chat.id,
@@ -145,58 +91,36 @@ def register_user_handlers(bot):
 
 
     # === КОМАНДА /time ===
-    @bot.message_handler(commands=['time'])
+    @router.command('time')
     def show_time_left(message):
-        time_left = get_time_until_sale()
-        bot.reply_to(
-            message,
-            f"⏳ <b>Осталось до старта продаж:</b> *{time_left}*",
-            parse_mode='HTML'
-        )
+        bot.reply_to(message, render('time_left'), parse_mode='HTML')
 
 
     # === КОМАНДА /promo ===
-    @bot.message_handler(commands=['promo'])
+    @router.command('promo')
     def send_promo_materials(message):
         user = message.from_user
         add_user(user.id, user.username, user.first_name, user.last_name)
         mark_as_interested(user.id)
 
         try:
-            with open(PROMO_VIDEO_PATH, 'rb') as video:
-                bot.send_video(message.chat.id, video, caption="🎥 Промо-видео о методичке")
+            send_cached_video(bot, message.chat.id, PROMO_VIDEO_PATH, caption="🎥 Промо-видео о методичке")
         except Exception as e:
             bot.send_message(message.chat.id, f"🎥 Видео временно недоступно: {e}")
 
         try:
-            with open(PROMO_DOC_PATH, 'rb') as doc:
-                bot.send_document(message.chat.id, doc, caption="📄 Промо-документ с подробной информацией")
+            send_cached_document(bot, message.chat.id, PROMO_DOC_PATH, caption="📄 Промо-документ с подробной информацией")
         except Exception as e:
             bot.send_message(message.chat.id, f"📄 Документ временно недоступен: {e}")
 
-        time_left = get_time_until_sale()
-        bot.send_message(
-            message.chat.id,
-            f"Спасибо за интерес! 🙌\n\n"
-            f"⏳ До старта продаж осталось: *{time_left}*\n\n"
-            f"Нажмите /start, чтобы увидеть меню.",
-            parse_mode='HTML'
-        )
+        bot.send_message(message.chat.id, render('promo_thanks'), parse_mode='HTML')
 
 
     # === КОМАНДА /buy ===
-    @bot.message_handler(commands=['buy'])
+    @router.command('buy')
     def send_payment_link(message):
-        now = datetime.now()
-
-        if now < SALE_START_DATE:
-            time_left = get_time_until_sale()
-            bot.reply_to(
-                message,
-                f"Продажи начнутся через: *{time_left}*\n\n"
-                f"Но вы можете уже сейчас сделать <b>предзаказ</b> — нажмите /start и выберите «💳 Предзаказ».",
-                parse_mode='HTML'
-            )
+        if not sale_started():
+            bot.reply_to(message, render('buy_before_sale'), parse_mode='HTML')
             return
 
         if is_paid(message.from_user.id):
@@ -215,7 +139,7 @@ def register_user_handlers(bot):
 
 
     # === ОБРАБОТКА ID ПЛАТЕЖА ===
-    @bot.message_handler(func=lambda message: "ID платежа" in message.text or "платежа" in message.text.lower())
+    @router.pattern(lambda message: "платежа" in message.text.lower())
     def process_payment(message):
         user_id = message.from_user.id
 
@@ -241,25 +165,33 @@ def register_user_handlers(bot):
             )
             return
 
-        add_payment(user_id, payment_id)
-
-        try:
-            with open(MANUAL_PATH, 'rb') as manual:
-                bot.send_document(
-                    user_id,
-                    manual,
-                    caption="📘 <b>Ваша методичка по медицинской наукометрии!</b>\n\n"
-                            "Спасибо за покупку! Если у вас возникнут вопросы, наши создатели всегда готовы помочь.",
-                    parse_mode='HTML'
-                )
-            bot.send_message(
-                user_id,
-                "🎉 Вы также были добавлены в закрытую беседу с создателями методички.\n\n"
-                "Добро пожаловать в сообщество профессионалов!"
+        if not add_payment(user_id, payment_id):
+            bot.reply_to(
+                message,
+                "❌ Этот ID платежа уже использован. Если это ошибка, напишите администратору."
             )
-        except Exception as e:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при отправке методички. Пожалуйста, свяжитесь с администратором."
+            return
+
+        # Методичку отправят потоки очереди выдачи (с повторами при ошибках)
+        manual_delivery.notify()
+        bot.reply_to(
+            message,
+            "✅ Оплата принята! Методичка придёт в этот чат в течение нескольких минут."
+        )
+
+
+    # === ОБРАЩЕНИЯ К АДМИНИСТРАТОРУ ===
+    @router.fallback
+    def handle_user_message(message):
+        """Сообщения без маршрута сохраняются как обращения; администраторы получают сводку"""
+        user = message.from_user
+        if user.id in ADMIN_IDS or message.text.startswith('/'):
+            return
+
+        add_user(user.id, user.username, user.first_name, user.last_name)
+        # Подтверждаем только первое сообщение обращения, чтобы не отвечать на каждое
+        if add_user_message(user.id, message.text):
+            bot.reply_to(
+                message,
+                "✉️ Сообщение передано администратору. Ответ придёт в этот чат."
             )
-            print(f"❌ Ошибка при отправке методички пользователю {user_id}: {e}")
\ No newline at end of file
@@ -0,0 +1,104 @@
+# write_behind.py
+import threading
+import time
+
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи: накапливает однотипные upsert'ы по ключу
+    и отдаёт их в flush_func одной пачкой — по размеру или по таймеру.
+
+    flush_func получает словарь {таблица: {ключ: строка}} и должен
+    записать всё в одной транзакции.
+    """
+
+    def __init__(self, flush_func, batch_size, flush_interval, on_flushed=None):
+        self.flush_func = flush_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flushed = on_flushed
+        self._pending = {}
+        self._size = 0
+        # Пачка, которая сейчас записывается в базу
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # Сериализует сами записи в базу, чтобы пачки не обгоняли друг друга
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+
+    def put(self, table, key, row, replace=True):
+        """Добавить строку; строка с тем же ключом заменяется (или сохраняется при replace=False)"""
+        with self._lock:
+            rows = self._pending.setdefault(table, {})
+            if key in rows:
+                if replace:
+                    rows[key] = row
+            else:
+                rows[key] = row
+                self._size += 1
+            full = self._size >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def contains(self, table, key):
+        """Есть ли строка в очереди или в записываемой сейчас пачке"""
+        with self._lock:
+            return key in self._pending.get(table, {}) or key in self._inflight.get(table, {})
+
+    def flush(self):
+        """Синхронно записать всё накопленное"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                size, self._size = self._size, 0
+                self._inflight = pending
+            if not size:
+                return 0
+
+            try:
+                self.flush_func(pending)
+            except Exception:
+                # Возвращаем строки в очередь, не затирая более свежие
+                with self._lock:
+                    self._inflight = {}
+                    for table, rows in pending.items():
+                        current = self._pending.setdefault(table, {})
+                        for key, row in rows.items():
+                            if key not in current:
+                                current[key] = row
+                                self._size += 1
+                raise
+
+            if self.on_flushed:
+                self.on_flushed(pending)
+            with self._lock:
+                self._inflight = {}
+            self.flushed_batches += 1
+            self.flushed_rows += size
+            return size
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка отложенной записи в базу: {e}")
+                time.sleep(self.flush_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановить фоновый поток и записать остаток"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()